@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+# Short-lived read caches shared by the API routers, dropped on known writes
+READ_CACHE_TTL = 5.0  # seconds
+
+_rooms_listing: Optional[Tuple[float, List[Dict[str, Any]]]] = None  # (fetched_at, rooms)
+
+def get_rooms_listing() -> Optional[List[Dict[str, Any]]]:
+    """Return the cached room listing, or None if it is missing or stale"""
+    if _rooms_listing is None or time.monotonic() - _rooms_listing[0] > READ_CACHE_TTL:
+        return None
+    return _rooms_listing[1]
+
+def set_rooms_listing(rooms: List[Dict[str, Any]]):
+    """Cache a freshly read room listing"""
+    global _rooms_listing
+    _rooms_listing = (time.monotonic(), rooms)
+
+def invalidate_rooms_listing():
+    """Drop the cached room listing after room occupancy changes"""
+    global _rooms_listing
+    _rooms_listing = None
+
+# Room detail responses, dropped whenever a room's assignments change
+ROOM_DETAILS_CACHE_SIZE = 1024
+_room_details: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def lookup_room_details(room_id: int) -> Optional[Dict[str, Any]]:
+    """Return a room's cached details, or None if they are missing or stale"""
+    cached = _room_details.get(room_id)
+    if cached is None or time.monotonic() - cached[0] > READ_CACHE_TTL:
+        return None
+    return cached[1]
+
+def store_room_details(room_id: int, details: Dict[str, Any]):
+    """Cache a room's details, evicting the least recently stored rooms"""
+    _room_details[room_id] = (time.monotonic(), details)
+    _room_details.move_to_end(room_id)
+    while len(_room_details) > ROOM_DETAILS_CACHE_SIZE:
+        _room_details.popitem(last=False)
+
+def invalidate_room_details(room_ids):
+    """Drop cached room details for rooms whose occupants changed"""
+    for room_id in room_ids:
+        _room_details.pop(room_id, None)
+
+# User responses, dropped whenever a user's row is written
+USER_CACHE_SIZE = 1024
+_users: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+def lookup_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """Return a user's cached response, or None if it is missing or stale"""
+    cached = _users.get(user_id)
+    if cached is None or time.monotonic() - cached[0] > READ_CACHE_TTL:
+        return None
+    return cached[1]
+
+def store_user(user_id: int, user: Dict[str, Any]):
+    """Cache a user's response, evicting the least recently stored users"""
+    _users[user_id] = (time.monotonic(), user)
+    _users.move_to_end(user_id)
+    while len(_users) > USER_CACHE_SIZE:
+        _users.popitem(last=False)
+
+def invalidate_users(user_ids):
+    """Drop cached responses for users whose rows changed"""
+    for user_id in user_ids:
+        _users.pop(user_id, None)
@@ -2,16 +2,72 @@ from fastapi import APIRouter, HTTPException, Depends
 import asyncpg
 import logging
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
 from ..database.db import get_db
 from ..services.ml_service import ml_service
-from ..services.embedding_service import generate_embedding, calculate_similarity
+from ..services.embedding_service import (
+    generate_embedding, calculate_similarity, normalize_embeddings, top_k_indices
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Weight of each algorithm in the final match score
+SCORE_WEIGHTS = {
+    'embedding_similarity': 0.3,
+    'knn_score': 0.2,
+    'svd_score': 0.15,
+    'logistic_score': 0.2,
+    'rule_based_score': 0.15
+}
+
+# Hot matching queries, kept as constants so asyncpg reuses their prepared statements
+USER_BY_ID_SQL = """
+    SELECT id, name, age, gender, occupation, sleep_schedule,
+           cleanliness_level, noise_tolerance, social_preference,
+           hobbies, dietary_restrictions, pet_preference,
+           smoking_preference, budget_range, location_preference,
+           embedding_vector
+    FROM users WHERE id = $1
+"""
+
+USERS_BY_IDS_SQL = """
+    SELECT id, name, age, gender, occupation, sleep_schedule,
+           cleanliness_level, noise_tolerance, social_preference,
+           hobbies, dietary_restrictions, pet_preference,
+           smoking_preference, budget_range, location_preference
+    FROM users 
+    WHERE id = ANY($1::int[])
+"""
+
+UPSERT_COMPATIBILITY_SQL = """
+    INSERT INTO compatibility_scores (user1_id, user2_id, knn_score, svd_score, final_score, explanation)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT (user1_id, user2_id) 
+    DO UPDATE SET 
+        knn_score = EXCLUDED.knn_score,
+        svd_score = EXCLUDED.svd_score,
+        final_score = EXCLUDED.final_score,
+        explanation = EXCLUDED.explanation,
+        created_at = CURRENT_TIMESTAMP
+"""
+
+# pgvector's default and maximum hnsw.ef_search candidate list sizes
+HNSW_DEFAULT_EF_SEARCH = 40
+HNSW_MAX_EF_SEARCH = 1000
+
+# Scalar subquery keeps the query vector a constant so the HNSW index serves the ORDER BY
+SIMILAR_USERS_SQL = """
+    SELECT id, name, age, gender, hobbies,
+           embedding_vector <=> (SELECT embedding_vector FROM users WHERE id = $1) AS distance
+    FROM users
+    WHERE id != $1 AND embedding_vector IS NOT NULL
+    ORDER BY embedding_vector <=> (SELECT embedding_vector FROM users WHERE id = $1)
+    LIMIT $2
+"""
+
 @router.get("/match/{user_id}")
 async def get_matches(user_id: int, limit: int = 5, db: asyncpg.Connection = Depends(get_db)):
     """
@@ -25,40 +81,32 @@ async def get_matches(user_id: int, limit: int = 5, db: asyncpg.Connection = Dep
     """
     try:
         # Check if user exists and has embedding
-        user = await db.fetchrow("""
-            SELECT id, name, age, gender, occupation, sleep_schedule,
-                   cleanliness_level, noise_tolerance, social_preference,
-                   hobbies, dietary_restrictions, pet_preference,
-                   smoking_preference, budget_range, location_preference,
-                   embedding_vector
-            FROM users WHERE id = $1
-        """, user_id)
+        user = await db.fetchrow(USER_BY_ID_SQL, user_id)
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        if not user['embedding_vector']:
+        if user['embedding_vector'] is None:
             raise HTTPException(
                 status_code=400, 
                 detail="User has no embedding. Please preprocess user data first."
             )
         
-        # Check if ML models are trained
-        model_status = ml_service.get_model_status()
-        if not model_status["models_trained"]:
-            # Try to load models
-            await ml_service.load_models()
-            model_status = ml_service.get_model_status()
-            
-            if not model_status["models_trained"]:
-                raise HTTPException(
-                    status_code=503,
-                    detail="ML models not available. Please train models first."
-                )
+        # Check if ML models are trained, loading them on first use
+        if not await ml_service.ensure_models_loaded():
+            raise HTTPException(
+                status_code=503,
+                detail="ML models not available. Please train models first."
+            )
         
         # Get matches using different algorithms
         matches = await _get_comprehensive_matches(user, limit, db)
         
+        # Cache the returned pair scores in one batch
+        await _store_compatibility_scores(
+            [(user_id, match['user_id'], match['scores']) for match in matches], db
+        )
+        
         return {
             "user_id": user_id,
             "user_name": user['name'],
@@ -81,55 +129,30 @@ async def get_simple_matches(user_id: int, limit: int = 5, db: asyncpg.Connectio
     try:
         # Get user data
         user = await db.fetchrow("""
-            SELECT id, name, age, gender, hobbies, embedding_vector
+            SELECT id, name, age, gender, hobbies,
+                   embedding_vector IS NOT NULL AS has_embedding
             FROM users WHERE id = $1
         """, user_id)
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        if not user['embedding_vector']:
+        if not user['has_embedding']:
             raise HTTPException(
                 status_code=400, 
                 detail="User has no embedding. Please preprocess user data first."
             )
         
-        # Get all other users with embeddings
-        other_users = await db.fetch("""
-            SELECT id, name, age, gender, hobbies, embedding_vector
-            FROM users 
-            WHERE id != $1 AND embedding_vector IS NOT NULL
-        """, user_id)
+        # Nearest neighbours come straight from the pgvector index
+        top_matches = await _rank_by_embedding_similarity(user, limit, db)
         
-        if not other_users:
+        if not top_matches:
             return {
                 "user_id": user_id,
                 "matches": [],
                 "message": "No other users found with embeddings"
             }
         
-        # Calculate similarities
-        similarities = []
-        user_embedding = np.array(user['embedding_vector'])
-        
-        for other_user in other_users:
-            other_embedding = np.array(other_user['embedding_vector'])
-            similarity = await calculate_similarity(user_embedding, other_embedding)
-            
-            similarities.append({
-                "user_id": other_user['id'],
-                "name": other_user['name'],
-                "age": other_user['age'],
-                "gender": other_user['gender'],
-                "hobbies": other_user['hobbies'],
-                "similarity_score": round(similarity, 4),
-                "algorithm": "embedding_similarity"
-            })
-        
-        # Sort by similarity and return top matches
-        similarities.sort(key=lambda x: x['similarity_score'], reverse=True)
-        top_matches = similarities[:limit]
-        
         return {
             "user_id": user_id,
             "user_name": user['name'],
@@ -154,24 +177,19 @@ async def calculate_compatibility(
     Calculate detailed compatibility score between two users
     """
     try:
-        # Get both users
-        user1 = await db.fetchrow("""
+        # Get both users in a single round trip
+        rows = await db.fetch("""
             SELECT id, name, age, gender, occupation, sleep_schedule,
                    cleanliness_level, noise_tolerance, social_preference,
                    hobbies, dietary_restrictions, pet_preference,
                    smoking_preference, budget_range, location_preference,
                    embedding_vector
-            FROM users WHERE id = $1
-        """, user1_id)
+            FROM users WHERE id = ANY($1::int[])
+        """, [user1_id, user2_id])
         
-        user2 = await db.fetchrow("""
-            SELECT id, name, age, gender, occupation, sleep_schedule,
-                   cleanliness_level, noise_tolerance, social_preference,
-                   hobbies, dietary_restrictions, pet_preference,
-                   smoking_preference, budget_range, location_preference,
-                   embedding_vector
-            FROM users WHERE id = $2
-        """, user2_id)
+        users_by_id = {row['id']: row for row in rows}
+        user1 = users_by_id.get(user1_id)
+        user2 = users_by_id.get(user2_id)
         
         if not user1 or not user2:
             raise HTTPException(status_code=404, detail="One or both users not found")
@@ -202,23 +220,49 @@ async def _get_comprehensive_matches(user: Dict[str, Any], limit: int, db: async
     matches = []
     
     try:
-        # Get all other users with embeddings
-        other_users = await db.fetch("""
-            SELECT id, name, age, gender, occupation, sleep_schedule,
-                   cleanliness_level, noise_tolerance, social_preference,
-                   hobbies, dietary_restrictions, pet_preference,
-                   smoking_preference, budget_range, location_preference,
-                   embedding_vector
-            FROM users 
-            WHERE id != $1 AND embedding_vector IS NOT NULL
-        """, user['id'])
-        
-        if not other_users:
+        # Every other user with an embedding is a candidate, straight from the cache
+        embedding_matrix = await ml_service.ensure_embedding_matrix(db)
+        unit_embeddings = ml_service.unit_embedding_matrix
+        feature_extras = ml_service.feature_extras
+        user_ids = ml_service.user_ids
+        id_to_row = ml_service.id_to_row
+        category_codes = ml_service.category_codes
+        category_values = ml_service.category_values
+        
+        candidate_rows = np.flatnonzero(user_ids != user['id'])
+        if len(candidate_rows) == 0:
             return []
+        candidate_ids = user_ids[candidate_rows]
+        
+        # Cosine similarity is a single GEMV against the unit-normalized cache
+        user_row = id_to_row.get(user['id'])
+        if user_row is not None:
+            user_unit = unit_embeddings[user_row]
+        else:
+            user_unit = normalize_embeddings(user['embedding_vector'])
+        embedding_similarities = (unit_embeddings @ user_unit)[candidate_rows]
+        
+        # Score every candidate with all algorithms in one batch
+        scores, final_scores = _score_all_candidates(
+            user, 
+            candidate_ids, 
+            _build_feature_rows(user, embedding_matrix, feature_extras, candidate_rows), 
+            embedding_similarities, 
+            _calculate_rule_based_scores(user, candidate_rows, category_codes, category_values)
+        )
         
-        # Calculate scores for each potential match
-        for other_user in other_users:
-            match_score = await _calculate_match_score(user, other_user)
+        # Select the top matches, then fetch display columns for those only
+        top = top_k_indices(final_scores, limit)
+        top_users = await db.fetch(USERS_BY_IDS_SQL, candidate_ids[top].tolist())
+        users_by_id = {row['id']: row for row in top_users}
+        
+        for i in top:
+            other_user = users_by_id.get(int(candidate_ids[i]))
+            if other_user is None:
+                continue  # Deleted since the cache was built
+            
+            match_score = {name: float(score) for name, score in zip(SCORE_WEIGHTS, scores[i])}
+            match_score['final_score'] = float(final_scores[i])
             
             matches.append({
                 "user_id": other_user['id'],
@@ -240,9 +284,7 @@ async def _get_comprehensive_matches(user: Dict[str, Any], limit: int, db: async
                 "final_score": match_score['final_score']
             })
         
-        # Sort by final score and return top matches
-        matches.sort(key=lambda x: x['final_score'], reverse=True)
-        return matches[:limit]
+        return matches
         
     except Exception as e:
         logger.error(f"Error in comprehensive matching: {e}")
@@ -253,42 +295,120 @@ async def _get_similarity_matches(user: Dict[str, Any], limit: int, db: asyncpg.
     Get matches using only embedding similarity (fallback method)
     """
     try:
-        # Get all other users with embeddings
-        other_users = await db.fetch("""
-            SELECT id, name, age, gender, hobbies, embedding_vector
-            FROM users 
-            WHERE id != $1 AND embedding_vector IS NOT NULL
-        """, user['id'])
-        
-        if not other_users:
-            return []
-        
-        # Calculate similarities
-        similarities = []
-        user_embedding = np.array(user['embedding_vector'])
-        
-        for other_user in other_users:
-            other_embedding = np.array(other_user['embedding_vector'])
-            similarity = await calculate_similarity(user_embedding, other_embedding)
-            
-            similarities.append({
-                "user_id": other_user['id'],
-                "name": other_user['name'],
-                "age": other_user['age'],
-                "gender": other_user['gender'],
-                "hobbies": other_user['hobbies'],
-                "similarity_score": round(similarity, 4),
-                "algorithm": "embedding_similarity"
-            })
-        
-        # Sort by similarity and return top matches
-        similarities.sort(key=lambda x: x['similarity_score'], reverse=True)
-        return similarities[:limit]
+        return await _rank_by_embedding_similarity(user, limit, db)
         
     except Exception as e:
         logger.error(f"Error in similarity matching: {e}")
         return []
 
+async def _rank_by_embedding_similarity(
+    user: Dict[str, Any], 
+    limit: int, 
+    db: asyncpg.Connection
+) -> List[Dict[str, Any]]:
+    """
+    Rank all other users by cosine similarity of their embeddings to the user's embedding
+    
+    The nearest-neighbour search runs inside PostgreSQL on the pgvector HNSW index,
+    so only the top-k rows' display columns ever leave the database. The query
+    vector is looked up server-side, so no embedding crosses the wire either way.
+    """
+    if limit > HNSW_DEFAULT_EF_SEARCH:
+        # An HNSW scan returns at most hnsw.ef_search rows, so widen it for this query only
+        async with db.transaction():
+            await db.execute(
+                "SELECT set_config('hnsw.ef_search', $1, true)", 
+                str(min(limit, HNSW_MAX_EF_SEARCH))
+            )
+            rows = await db.fetch(SIMILAR_USERS_SQL, user['id'], limit)
+    else:
+        rows = await db.fetch(SIMILAR_USERS_SQL, user['id'], max(limit, 0))
+    
+    return [
+        {
+            "user_id": row['id'],
+            "name": row['name'],
+            "age": row['age'],
+            "gender": row['gender'],
+            "hobbies": row['hobbies'],
+            "similarity_score": round(1.0 - row['distance'], 4),
+            "algorithm": "embedding_similarity"
+        }
+        for row in rows
+    ]
+
+def _build_feature_rows(
+    user: Dict[str, Any], 
+    embedding_matrix: np.ndarray, 
+    feature_extras: np.ndarray, 
+    candidate_rows: np.ndarray
+) -> np.ndarray:
+    """
+    Build the unscaled model features of the user (row 0) and every candidate
+    
+    One float32 buffer is allocated and filled in place; the candidates' cached
+    embeddings and extras are gathered straight into their column blocks.
+    """
+    dimension = embedding_matrix.shape[1]
+    features = np.empty((len(candidate_rows) + 1, dimension + feature_extras.shape[1]), dtype=np.float32)
+    features[0] = _create_feature_matrix([user])[0]
+    np.take(embedding_matrix, candidate_rows, axis=0, out=features[1:, :dimension])
+    np.take(feature_extras, candidate_rows, axis=0, out=features[1:, dimension:])
+    return features
+
+def _score_all_candidates(
+    user: Dict[str, Any], 
+    candidate_ids: np.ndarray, 
+    features: np.ndarray, 
+    embedding_similarities: np.ndarray, 
+    rule_scores: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every candidate against the user with all algorithms at once
+    
+    Candidates are given as ids, and `features` holds the unscaled (N + 1, d + 5)
+    model features of the user (row 0) followed by the candidates. Returns an
+    (N, 5) matrix whose columns follow `SCORE_WEIGHTS`, and the (N,) weighted
+    final scores. Each model is queried once per request.
+    """
+    scores = np.zeros((len(candidate_ids), len(SCORE_WEIGHTS)))
+    
+    # 1. Embedding similarity score
+    scores[:, 0] = embedding_similarities
+    
+    # Build and scale features once for all three models; row 0 is the user
+    scaled = None
+    if ml_service.knn_model or ml_service.svd_model or ml_service.logistic_model:
+        try:
+            scaled = ml_service.scaler.transform(features)
+        except Exception as e:
+            logger.error(f"Error scaling features: {e}")
+    
+    if scaled is not None:
+        # 2. KNN score (if model available)
+        if ml_service.knn_model:
+            scores[:, 1] = _calculate_knn_scores(scaled[:1], candidate_ids)
+        
+        # 3. SVD score (if model available)
+        if ml_service.svd_model:
+            scores[:, 2] = _calculate_svd_scores(scaled)
+        
+        # 4. Logistic Regression score (if model available)
+        if ml_service.logistic_model:
+            scores[:, 3] = _calculate_logistic_scores(scaled[1:])
+    
+    # 5. Rule-based compatibility score
+    scores[:, 4] = rule_scores
+    
+    # Round all 5N scores in one vectorized pass, then calculate final weighted score
+    np.round(scores, 4, out=scores)
+    weights = np.fromiter(SCORE_WEIGHTS.values(), dtype=np.float64)
+    final_scores = scores @ weights
+    final_scores /= weights.sum()
+    np.round(final_scores, 4, out=final_scores)
+    
+    return scores, final_scores
+
 async def _calculate_match_score(user1: Dict[str, Any], user2: Dict[str, Any]) -> Dict[str, float]:
     """
     Calculate match score using multiple algorithms
@@ -297,8 +417,8 @@ async def _calculate_match_score(user1: Dict[str, Any], user2: Dict[str, Any]) -
     
     try:
         # 1. Embedding similarity score
-        if user1['embedding_vector'] and user2['embedding_vector']:
-            embedding_sim = await calculate_similarity(
+        if _has_embedding(user1) and _has_embedding(user2):
+            embedding_sim = calculate_similarity(
                 user1['embedding_vector'], 
                 user2['embedding_vector']
             )
@@ -306,24 +426,29 @@ async def _calculate_match_score(user1: Dict[str, Any], user2: Dict[str, Any]) -
         else:
             scores['embedding_similarity'] = 0.0
         
+        # Build and scale both users' features once for all three models
+        scaled = None
+        if ml_service.knn_model or ml_service.svd_model or ml_service.logistic_model:
+            scaled = _scale_features([user1, user2])
+        
         # 2. KNN score (if model available)
-        if ml_service.knn_model:
-            knn_score = await _calculate_knn_score(user1, user2)
-            scores['knn_score'] = round(knn_score, 4)
+        if ml_service.knn_model and scaled is not None:
+            knn_score = _calculate_knn_scores(scaled[:1], np.array([user2['id']]))[0]
+            scores['knn_score'] = round(float(knn_score), 4)
         else:
             scores['knn_score'] = 0.0
         
         # 3. SVD score (if model available)
-        if ml_service.svd_model:
-            svd_score = await _calculate_svd_score(user1, user2)
-            scores['svd_score'] = round(svd_score, 4)
+        if ml_service.svd_model and scaled is not None:
+            svd_score = _calculate_svd_scores(scaled)[0]
+            scores['svd_score'] = round(float(svd_score), 4)
         else:
             scores['svd_score'] = 0.0
         
         # 4. Logistic Regression score (if model available)
-        if ml_service.logistic_model:
-            logistic_score = await _calculate_logistic_score(user1, user2)
-            scores['logistic_score'] = round(logistic_score, 4)
+        if ml_service.logistic_model and scaled is not None:
+            logistic_score = _calculate_logistic_scores(scaled[1:])[0]
+            scores['logistic_score'] = round(float(logistic_score), 4)
         else:
             scores['logistic_score'] = 0.0
         
@@ -348,82 +473,77 @@ async def _calculate_match_score(user1: Dict[str, Any], user2: Dict[str, Any]) -
             'final_score': 0.0
         }
 
-async def _calculate_knn_score(user1: Dict[str, Any], user2: Dict[str, Any]) -> float:
+def _scale_features(users: List[Dict[str, Any]]) -> Optional[np.ndarray]:
     """
-    Calculate KNN-based similarity score
+    Build and scale the feature rows of several users with one scaler call
+    
+    Returns None if the features cannot be scaled (e.g. the scaler is not fitted).
     """
     try:
-        # Create feature vector for user1
-        user1_features = _create_feature_vector(user1)
-        user2_features = _create_feature_vector(user2)
-        
-        # Scale features
-        user1_scaled = ml_service.scaler.transform([user1_features])
-        user2_scaled = ml_service.scaler.transform([user2_features])
-        
-        # Calculate distance using KNN model
-        distances, indices = ml_service.knn_model.kneighbors(user1_scaled)
-        
-        # Check if user2 is in the nearest neighbors
-        if user2['id'] in indices[0]:
-            # Return inverse of distance (closer = higher score)
-            distance_idx = list(indices[0]).index(user2['id'])
-            distance = distances[0][distance_idx]
-            return max(0, 1 - distance)
-        else:
-            return 0.0
-            
+        return ml_service.scaler.transform(_create_feature_matrix(users))
+        
     except Exception as e:
-        logger.error(f"Error calculating KNN score: {e}")
-        return 0.0
+        logger.error(f"Error scaling features: {e}")
+        return None
 
-async def _calculate_svd_score(user1: Dict[str, Any], user2: Dict[str, Any]) -> float:
+def _calculate_knn_scores(user_scaled: np.ndarray, candidate_ids: np.ndarray) -> np.ndarray:
     """
-    Calculate SVD-based similarity score
+    Calculate KNN-based similarity scores for every candidate
+    
+    The model is queried once with the user's scaled feature row. Only candidates
+    among the nearest neighbours score; closer = higher score.
     """
+    scores = np.zeros(len(candidate_ids))
+    if ml_service.training_user_ids is None:
+        return scores
+    
     try:
-        # Create feature vectors
-        user1_features = _create_feature_vector(user1)
-        user2_features = _create_feature_vector(user2)
+        distances, indices = ml_service.knn_neighbors(user_scaled)
         
-        # Scale features
-        user1_scaled = ml_service.scaler.transform([user1_features])
-        user2_scaled = ml_service.scaler.transform([user2_features])
+        # KNN indices are rows of the training matrix, not user ids
+        neighbor_ids = ml_service.training_user_ids[indices[0]]
+        is_neighbor = candidate_ids[:, None] == neighbor_ids[None, :]
+        found = is_neighbor.any(axis=1)
+        scores[found] = np.maximum(0, 1 - distances[0][is_neighbor[found].argmax(axis=1)])
+        return scores
         
-        # Transform using SVD
-        user1_reduced = ml_service.svd_model.transform(user1_scaled)
-        user2_reduced = ml_service.svd_model.transform(user2_scaled)
+    except Exception as e:
+        logger.error(f"Error calculating KNN scores: {e}")
+        return scores
+
+def _calculate_svd_scores(scaled: np.ndarray) -> np.ndarray:
+    """
+    Calculate SVD-based similarity scores between a user and every candidate
+    
+    `scaled` holds the user's scaled features in row 0 and the candidates' below.
+    All rows are projected in a single batch, then compared with one
+    matrix-vector product in the reduced space.
+    """
+    try:
+        reduced = ml_service.svd_model.transform(scaled)
         
         # Calculate cosine similarity in reduced space
-        similarity = np.dot(user1_reduced[0], user2_reduced[0]) / (
-            np.linalg.norm(user1_reduced[0]) * np.linalg.norm(user2_reduced[0])
-        )
-        
-        return max(0, similarity)
+        reduced /= np.linalg.norm(reduced, axis=1, keepdims=True) + 1e-12
+        return np.maximum(reduced[1:] @ reduced[0], 0)
         
     except Exception as e:
-        logger.error(f"Error calculating SVD score: {e}")
-        return 0.0
+        logger.error(f"Error calculating SVD scores: {e}")
+        return np.zeros(len(scaled) - 1)
 
-async def _calculate_logistic_score(user1: Dict[str, Any], user2: Dict[str, Any]) -> float:
+def _calculate_logistic_scores(candidates_scaled: np.ndarray) -> np.ndarray:
     """
-    Calculate Logistic Regression compatibility score
+    Calculate Logistic Regression compatibility scores for every candidate
+    
+    The model is trained on single-user feature rows, so candidates are scored on
+    their own scaled features with one batched predict_proba call.
     """
     try:
-        # Create combined feature vector
-        combined_features = _create_combined_feature_vector(user1, user2)
-        
-        # Scale features
-        combined_scaled = ml_service.scaler.transform([combined_features])
-        
-        # Get probability from logistic regression
-        probability = ml_service.logistic_model.predict_proba(combined_scaled)[0][1]
-        
-        return probability
+        # Get probabilities from logistic regression
+        return ml_service.logistic_model.predict_proba(candidates_scaled)[:, 1]
         
     except Exception as e:
-        logger.error(f"Error calculating logistic score: {e}")
-        return 0.0
+        logger.error(f"Error calculating logistic scores: {e}")
+        return np.zeros(len(candidates_scaled))
 
 def _calculate_rule_based_score(user1: Dict[str, Any], user2: Dict[str, Any]) -> float:
     """
@@ -468,6 +588,65 @@ def _calculate_rule_based_score(user1: Dict[str, Any], user2: Dict[str, Any]) ->
     
     return min(score, 1.0)
 
+def _calculate_rule_based_scores(
+    user: Dict[str, Any], 
+    rows: np.ndarray, 
+    category_codes: Dict[str, np.ndarray], 
+    category_values: Dict[str, List[Any]]
+) -> np.ndarray:
+    """
+    Calculate rule-based compatibility scores against many cached users at once
+    
+    Vectorized equivalent of `_calculate_rule_based_score` over the categorical
+    codes cached by `ml_service`; `rows` are cache row indices of the candidates.
+    """
+    def codes_for(column: str) -> Tuple[np.ndarray, int]:
+        # Candidate codes plus the user's code (-1 for NULL, -2 if never seen)
+        values = category_values[column]
+        value = user[column]
+        if value is None:
+            user_code = -1
+        elif value in values:
+            user_code = values.index(value)
+        else:
+            user_code = -2
+        return category_codes[column][rows], user_code
+    
+    def ordinal_close(column: str, codes: np.ndarray, to_number) -> np.ndarray:
+        # Code -1 (NULL) indexes the trailing entry, mapped like any unknown level
+        lookup = np.array([to_number(v) for v in category_values[column]] + [to_number(None)], dtype=np.int8)
+        return np.abs(lookup[codes] - to_number(user[column])) <= 1
+    
+    score = np.full(len(rows), 0.5)
+    
+    # Sleep schedule compatibility
+    codes, user_code = codes_for('sleep_schedule')
+    same = codes == user_code
+    if user['sleep_schedule'] == 'flexible':
+        flexible = np.ones(len(rows), dtype=bool)
+    elif 'flexible' in category_values['sleep_schedule']:
+        flexible = codes == category_values['sleep_schedule'].index('flexible')
+    else:
+        flexible = np.zeros(len(rows), dtype=bool)
+    score += 0.1 * same + 0.05 * (~same & flexible)
+    
+    # Cleanliness, noise tolerance and social preference compatibility
+    for column, to_number in (
+        ('cleanliness_level', _cleanliness_to_number),
+        ('noise_tolerance', _noise_to_number),
+        ('social_preference', _social_to_number)
+    ):
+        codes, user_code = codes_for(column)
+        same = codes == user_code
+        score += 0.1 * same + 0.05 * (~same & ordinal_close(column, codes, to_number))
+    
+    # Pet and smoking preference compatibility
+    for column in ('pet_preference', 'smoking_preference'):
+        codes, user_code = codes_for(column)
+        score += 0.1 * (codes == user_code)
+    
+    return np.minimum(score, 1.0)
+
 def _cleanliness_to_number(level: str) -> int:
     """Convert cleanliness level to number"""
     mapping = {
@@ -501,41 +680,36 @@ def _social_to_number(level: str) -> int:
     }
     return mapping.get(level, 2)
 
-def _create_feature_vector(user: Dict[str, Any]) -> np.ndarray:
-    """Create feature vector for ML models"""
-    features = []
-    
-    # Embedding vector
-    if user['embedding_vector']:
-        features.extend(user['embedding_vector'])
-    else:
-        features.extend([0.0] * 384)  # Default embedding size
-    
-    # Additional features
-    if user['age']:
-        features.append(user['age'] / 100.0)
-    else:
-        features.append(0.5)
-    
-    # Categorical features
-    features.extend(_encode_categorical_features(user))
-    
-    return np.array(features)
+def _has_embedding(user: Dict[str, Any]) -> bool:
+    """Check for a non-empty embedding without relying on ndarray truthiness"""
+    embedding = user['embedding_vector']
+    return embedding is not None and len(embedding) > 0
 
-def _create_combined_feature_vector(user1: Dict[str, Any], user2: Dict[str, Any]) -> np.ndarray:
-    """Create combined feature vector for compatibility prediction"""
-    # Combine features from both users
-    user1_features = _create_feature_vector(user1)
-    user2_features = _create_feature_vector(user2)
+def _create_feature_matrix(users: List[Dict[str, Any]]) -> np.ndarray:
+    """
+    Create the (N, d + 5) feature matrix for ML models, one row per user
     
-    # Concatenate and add interaction features
-    combined = np.concatenate([user1_features, user2_features])
+    Rows are written straight into one preallocated float32 buffer instead of
+    concatenating small per-user arrays.
+    """
+    dimension = next(
+        (len(user['embedding_vector']) for user in users if _has_embedding(user)),
+        384  # Default embedding size
+    )
+    features = np.zeros((len(users), dimension + 5), dtype=np.float32)
     
-    # Add interaction features (differences)
-    differences = np.abs(user1_features - user2_features)
-    combined = np.concatenate([combined, differences])
+    for i, user in enumerate(users):
+        # Embedding vector (decoded from pgvector as a float32 ndarray); zeros if missing
+        if _has_embedding(user):
+            features[i, :dimension] = user['embedding_vector']
+        
+        # Additional features
+        features[i, dimension] = user['age'] / 100.0 if user['age'] else 0.5
+        
+        # Categorical features
+        features[i, dimension + 1:] = _encode_categorical_features(user)
     
-    return combined
+    return features
 
 def _encode_categorical_features(user: Dict[str, Any]) -> List[float]:
     """Encode categorical features as numerical values"""
@@ -583,18 +757,10 @@ def _encode_categorical_features(user: Dict[str, Any]) -> List[float]:
 
 def _calculate_final_score(scores: Dict[str, float]) -> float:
     """Calculate final weighted score"""
-    weights = {
-        'embedding_similarity': 0.3,
-        'knn_score': 0.2,
-        'svd_score': 0.15,
-        'logistic_score': 0.2,
-        'rule_based_score': 0.15
-    }
-    
     final_score = 0.0
     total_weight = 0.0
     
-    for score_name, weight in weights.items():
+    for score_name, weight in SCORE_WEIGHTS.items():
         if score_name in scores:
             final_score += scores[score_name] * weight
             total_weight += weight
@@ -607,19 +773,19 @@ async def _calculate_detailed_compatibility(user1: Dict[str, Any], user2: Dict[s
 
 async def _store_compatibility_score(user1_id: int, user2_id: int, scores: Dict[str, float], db: asyncpg.Connection):
     """Store compatibility score in database"""
+    await _store_compatibility_scores([(user1_id, user2_id, scores)], db)
+
+async def _store_compatibility_scores(
+    pairs: List[Tuple[int, int, Dict[str, float]]], 
+    db: asyncpg.Connection
+):
+    """Store many (user1_id, user2_id, scores) compatibility rows in one executemany batch"""
     try:
-        await db.execute("""
-            INSERT INTO compatibility_scores (user1_id, user2_id, knn_score, svd_score, final_score, explanation)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            ON CONFLICT (user1_id, user2_id) 
-            DO UPDATE SET 
-                knn_score = $3,
-                svd_score = $4,
-                final_score = $5,
-                explanation = $6,
-                created_at = CURRENT_TIMESTAMP
-        """, user1_id, user2_id, scores.get('knn_score', 0.0), 
+        await db.executemany(UPSERT_COMPATIBILITY_SQL, [
+            (user1_id, user2_id, scores.get('knn_score', 0.0), 
              scores.get('svd_score', 0.0), scores.get('final_score', 0.0),
              f"ML-based compatibility score: {scores}")
+            for user1_id, user2_id, scores in pairs
+        ])
     except Exception as e:
-        logger.error(f"Error storing compatibility score: {e}") 
\ No newline at end of file
+        logger.error(f"Error storing compatibility score: {e}")
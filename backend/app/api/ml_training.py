@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 import asyncpg
 import logging
+import time
+from typing import Optional, Tuple
 
 from ..database.db import get_db
 from ..services.ml_service import ml_service
@@ -8,6 +10,26 @@ from ..services.ml_service import ml_service
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# User counts only change on signup, so they are cached for a short TTL
+USER_COUNTS_TTL = 1.0  # seconds
+_user_counts: Optional[Tuple[float, int, int]] = None  # (fetched_at, total, with_embeddings)
+
+async def _get_user_counts(db: asyncpg.Connection) -> Tuple[int, int]:
+    """
+    Return (total users, users with embeddings), cached for USER_COUNTS_TTL seconds
+    """
+    global _user_counts
+    
+    now = time.monotonic()
+    if _user_counts is None or now - _user_counts[0] > USER_COUNTS_TTL:
+        total_users = await db.fetchval("SELECT COUNT(*) FROM users")
+        users_with_embeddings = await db.fetchval("""
+            SELECT COUNT(*) FROM users WHERE embedding_vector IS NOT NULL
+        """)
+        _user_counts = (now, total_users, users_with_embeddings)
+    
+    return _user_counts[1], _user_counts[2]
+
 @router.post("/train-models/")
 async def train_models(db: asyncpg.Connection = Depends(get_db)):
     """
@@ -96,10 +118,7 @@ async def get_training_requirements(db: asyncpg.Connection = Depends(get_db)):
     """
     try:
         # Get user statistics
-        total_users = await db.fetchval("SELECT COUNT(*) FROM users")
-        users_with_embeddings = await db.fetchval("""
-            SELECT COUNT(*) FROM users WHERE embedding_vector IS NOT NULL
-        """)
+        total_users, users_with_embeddings = await _get_user_counts(db)
         
         # Check if we have enough data for training
         can_train = users_with_embeddings >= 10
@@ -1,17 +1,62 @@
 from fastapi import APIRouter, HTTPException, Depends
+import asyncio
 import asyncpg
 import logging
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set, Tuple
 import json
 
 from ..database.db import get_db
-from ..services.embedding_service import generate_embedding, preprocess_hobbies_text
+from ..services.embedding_service import (
+    generate_embedding, 
+    generate_embeddings_batch, 
+    preprocess_hobbies_text,
+    text_hash,
+    cache_embedding,
+    get_model_async
+)
+from ..services.ml_service import ml_service
+from ._cache import invalidate_users
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Users embedded per batch while the previous batch is written to the database
+PREPROCESS_CHUNK_SIZE = 256
+
+# (column, prefix, suffix) of each part of a user's text representation, in order
+USER_TEXT_FIELDS = [
+    ('name', "Name: ", ""),
+    ('age', "Age: ", " years old"),
+    ('gender', "Gender: ", ""),
+    ('occupation', "Occupation: ", ""),
+    ('sleep_schedule', "Sleep schedule: ", ""),
+    ('cleanliness_level', "Cleanliness: ", ""),
+    ('noise_tolerance', "Noise tolerance: ", ""),
+    ('social_preference', "Social preference: ", ""),
+    ('hobbies', "Hobbies and interests: ", ""),
+    ('dietary_restrictions', "Dietary restrictions: ", ""),
+    ('pet_preference', "Pet preference: ", ""),
+    ('smoking_preference', "Smoking preference: ", ""),
+    ('budget_range', "Budget range: ", ""),
+    ('location_preference', "Location preference: ", "")
+]
+
+# Columns needed to build text representations and detect stale embeddings,
+# one chunk at a time by id
+PREPROCESS_USERS_SQL = """
+    SELECT id, name, age, gender, occupation, sleep_schedule, 
+           cleanliness_level, noise_tolerance, social_preference,
+           hobbies, dietary_restrictions, pet_preference, 
+           smoking_preference, budget_range, location_preference,
+           text_hash, embedding_vector IS NOT NULL AS has_embedding
+    FROM users
+    WHERE id > $1
+    ORDER BY id
+    LIMIT $2
+"""
+
 @router.post("/preprocess-dataset/")
 async def preprocess_dataset(db: asyncpg.Connection = Depends(get_db)):
     """
@@ -23,44 +68,70 @@ async def preprocess_dataset(db: asyncpg.Connection = Depends(get_db)):
     - Personal characteristics
     """
     try:
-        # Fetch all users from database
-        users = await db.fetch("""
-            SELECT id, name, age, gender, occupation, sleep_schedule, 
-                   cleanliness_level, noise_tolerance, social_preference,
-                   hobbies, dietary_restrictions, pet_preference, 
-                   smoking_preference, budget_range, location_preference
-            FROM users
-        """)
+        size = PREPROCESS_CHUNK_SIZE
+        total_count = 0
+        skipped_count = 0
+        processed_count = 0
+        
+        # Dummy fallback embeddings must be recomputed once the model is available
+        store_hashes = await get_model_async() is not None
         
-        if not users:
+        # Page through users by id so memory stays bounded by the chunk size and no
+        # long transaction holds their rows; each chunk is fetched and embedded while
+        # the previous one is written
+        previous = None
+        last_id = 0
+        current = None
+        try:
+            while True:
+                rows = await db.fetch(PREPROCESS_USERS_SQL, last_id, size)
+                total_count += len(rows)
+                if rows:
+                    last_id = rows[-1]['id']
+                
+                # Skip users whose embedding already matches their current text
+                users, user_texts, text_hashes = _select_changed_users(rows)
+                skipped_count += len(rows) - len(users)
+                
+                current = None
+                if users:
+                    stored = await _load_stored_embeddings(text_hashes, db)
+                    pending = asyncio.ensure_future(generate_embeddings_batch(user_texts))
+                    current = (users, text_hashes, stored, pending)
+                
+                if previous is not None:
+                    processed_count += await _write_chunk_embeddings(*previous, store_hashes, db)
+                previous = current
+                
+                if not rows:
+                    break
+        finally:
+            # A failed write or fetch must not leave a chunk's embedding task running
+            for chunk in (previous, current):
+                if chunk is not None and not chunk[3].done():
+                    chunk[3].cancel()
+        
+        if not total_count:
             return {
                 "message": "No users found in database",
                 "processed_count": 0,
                 "status": "completed"
             }
         
-        processed_count = 0
+        if not processed_count:
+            return {
+                "message": "All users are already up to date",
+                "processed_count": 0,
+                "skipped_count": skipped_count,
+                "status": "completed"
+            }
         
-        for user in users:
-            # Create comprehensive text representation for embedding
-            user_text = _create_user_text_representation(user)
-            
-            # Generate embedding
-            embedding = await generate_embedding(user_text)
-            
-            # Update user with embedding
-            await db.execute("""
-                UPDATE users 
-                SET embedding_vector = $1, updated_at = CURRENT_TIMESTAMP
-                WHERE id = $2
-            """, embedding, user['id'])
-            
-            processed_count += 1
-            logger.info(f"Processed user {user['id']}: {user['name']}")
+        ml_service.invalidate_embedding_matrix()
         
         return {
             "message": f"Successfully processed {processed_count} users",
             "processed_count": processed_count,
+            "skipped_count": skipped_count,
             "status": "completed"
         }
         
@@ -92,12 +163,14 @@ async def preprocess_user(user_id: int, db: asyncpg.Connection = Depends(get_db)
         # Generate embedding
         embedding = await generate_embedding(user_text)
         
-        # Update user
+        # Update user; dummy fallback embeddings get no hash so they are redone later
         await db.execute("""
             UPDATE users 
-            SET embedding_vector = $1, updated_at = CURRENT_TIMESTAMP
-            WHERE id = $2
-        """, embedding, user_id)
+            SET embedding_vector = $1, text_hash = $2, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $3
+        """, embedding, text_hash(user_text) if await get_model_async() is not None else None, user_id)
+        ml_service.invalidate_embedding_matrix()
+        invalidate_users([user_id])
         
         return {
             "message": f"Successfully processed user {user_id}",
@@ -118,13 +191,14 @@ async def get_preprocessing_stats(db: asyncpg.Connection = Depends(get_db)):
     Get statistics about data preprocessing status
     """
     try:
-        # Get total users
-        total_users = await db.fetchval("SELECT COUNT(*) FROM users")
-        
-        # Get users with embeddings
-        users_with_embeddings = await db.fetchval("""
-            SELECT COUNT(*) FROM users WHERE embedding_vector IS NOT NULL
+        # Get total users and users with embeddings in one scan
+        stats = await db.fetchrow("""
+            SELECT COUNT(*) AS total_users,
+                   COUNT(*) FILTER (WHERE embedding_vector IS NOT NULL) AS users_with_embeddings
+            FROM users
         """)
+        total_users = stats['total_users']
+        users_with_embeddings = stats['users_with_embeddings']
         
         # Get users without embeddings
         users_without_embeddings = total_users - users_with_embeddings
@@ -140,61 +214,126 @@ async def get_preprocessing_stats(db: asyncpg.Connection = Depends(get_db)):
         logger.error(f"Error getting preprocessing stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def _create_user_text_representation(user: Dict[str, Any]) -> str:
-    """
-    Create a comprehensive text representation of user data for embedding generation
+def _select_changed_users(users: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str], List[bytes]]:
     """
-    text_parts = []
+    Build text representations and keep only users whose embedding does not match them
     
-    # Basic information
-    if user['name']:
-        text_parts.append(f"Name: {user['name']}")
-    
-    if user['age']:
-        text_parts.append(f"Age: {user['age']} years old")
-    
-    if user['gender']:
-        text_parts.append(f"Gender: {user['gender']}")
+    Returns the changed users with their texts and text hashes.
+    """
+    user_texts = _create_user_text_representations(users)
+    text_hashes = [text_hash(text) for text in user_texts]
+    changed = [
+        i for i, user in enumerate(users)
+        if not (user['has_embedding'] and user['text_hash'] == text_hashes[i])
+    ]
+    return (
+        [users[i] for i in changed],
+        [user_texts[i] for i in changed],
+        [text_hashes[i] for i in changed]
+    )
+
+async def _write_chunk_embeddings(
+    users: List[Dict[str, Any]], 
+    text_hashes: List[bytes], 
+    stored: Set[bytes], 
+    pending: "asyncio.Future[List[np.ndarray]]", 
+    store_hashes: bool, 
+    db: asyncpg.Connection
+) -> int:
+    """
+    Wait for a chunk's embeddings and write them to users and the embedding cache
     
-    if user['occupation']:
-        text_parts.append(f"Occupation: {user['occupation']}")
+    Returns the number of users updated.
+    """
+    embeddings = await pending
+    keys = text_hashes if store_hashes else [None] * len(users)
     
-    # Lifestyle preferences
-    if user['sleep_schedule']:
-        text_parts.append(f"Sleep schedule: {user['sleep_schedule']}")
+    # Each chunk commits on its own, so a later failure keeps earlier chunks' work
+    async with db.transaction():
+        # Update the chunk's users with their embeddings in one batch
+        await db.executemany("""
+            UPDATE users 
+            SET embedding_vector = $1, text_hash = $2, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $3
+        """, [
+            (embedding, key, user['id'])
+            for user, key, embedding in zip(users, keys, embeddings)
+        ])
+        await _store_embeddings([
+            (key, embedding) for key, embedding in zip(text_hashes, embeddings)
+            if key not in stored
+        ], db)
     
-    if user['cleanliness_level']:
-        text_parts.append(f"Cleanliness: {user['cleanliness_level']}")
+    # The rows' embeddings and updated_at changed, so cached responses are stale
+    invalidate_users(user['id'] for user in users)
     
-    if user['noise_tolerance']:
-        text_parts.append(f"Noise tolerance: {user['noise_tolerance']}")
+    for user in users:
+        logger.info(f"Processed user {user['id']}: {user['name']}")
     
-    if user['social_preference']:
-        text_parts.append(f"Social preference: {user['social_preference']}")
+    return len(users)
+
+async def _load_stored_embeddings(text_hashes: List[bytes], db: asyncpg.Connection) -> Set[bytes]:
+    """
+    Seed the in-process embedding cache from the embedding_cache table
     
-    # Hobbies and interests (most important for matching)
-    if user['hobbies']:
-        hobbies_text = preprocess_hobbies_text(user['hobbies'])
-        text_parts.append(f"Hobbies and interests: {hobbies_text}")
+    Returns the hashes that were found, so they are not written back.
+    """
+    rows = await db.fetch("""
+        SELECT text_hash, embedding FROM embedding_cache
+        WHERE text_hash = ANY($1::bytea[])
+    """, list(set(text_hashes)))
     
-    # Dietary preferences
-    if user['dietary_restrictions']:
-        text_parts.append(f"Dietary restrictions: {user['dietary_restrictions']}")
+    for row in rows:
+        cache_embedding(row['text_hash'], row['embedding'])
     
-    # Pet preferences
-    if user['pet_preference']:
-        text_parts.append(f"Pet preference: {user['pet_preference']}")
+    return {row['text_hash'] for row in rows}
+
+async def _store_embeddings(embeddings: List[Tuple[bytes, np.ndarray]], db: asyncpg.Connection):
+    """
+    Persist newly computed (text_hash, embedding) pairs to the embedding_cache table
+    """
+    # Dummy fallback embeddings must never be cached
+    if not embeddings or await get_model_async() is None:
+        return
     
-    # Smoking preferences
-    if user['smoking_preference']:
-        text_parts.append(f"Smoking preference: {user['smoking_preference']}")
+    await db.executemany("""
+        INSERT INTO embedding_cache (text_hash, embedding)
+        VALUES ($1, $2)
+        ON CONFLICT (text_hash) DO NOTHING
+    """, embeddings)
+
+def _create_user_text_representations(users: List[Dict[str, Any]]) -> List[str]:
+    """
+    Create the text representations of many users with column-wise pandas string ops
     
-    # Budget and location
-    if user['budget_range']:
-        text_parts.append(f"Budget range: {user['budget_range']}")
+    Produces exactly what `_create_user_text_representation` would for each user.
+    """
+    columns = {field: [user[field] for user in users] for field, _, _ in USER_TEXT_FIELDS}
+    df = pd.DataFrame(columns, dtype=object)
+    text = pd.Series([""] * len(users), dtype=object)
     
-    if user['location_preference']:
-        text_parts.append(f"Location preference: {user['location_preference']}")
+    for field, prefix, suffix in USER_TEXT_FIELDS:
+        present = df[field].astype(bool)
+        values = df.loc[present, field].astype(str)
+        if field == 'hobbies':
+            # Same normalization as preprocess_hobbies_text
+            values = values.str.strip().str.lower().str.split().str.join(" ")
+            values = values.where(values != "", "no hobbies specified")
+        
+        part = prefix + values + suffix
+        previous = text[present]
+        text[present] = np.where(previous != "", previous + " | " + part, part)
     
-    # Combine all parts
-    return " | ".join(text_parts) if text_parts else "No information available" 
\ No newline at end of file
+    text[text == ""] = "No information available"
+    return text.tolist()
+
+def _create_user_text_representation(user: Dict[str, Any]) -> str:
+    """
+    Create a comprehensive text representation of user data for embedding generation
+    """
+    text = " | ".join(
+        f"{prefix}{preprocess_hobbies_text(user[field]) if field == 'hobbies' else user[field]}{suffix}"
+        for field, prefix, suffix in USER_TEXT_FIELDS
+        if user[field]
+    )
+    return text or "No information available"
@@ -5,10 +5,45 @@ from typing import List, Dict, Any, Optional
 
 from ..database.db import get_db
 from ..services.room_allocation_service import room_allocation_service
+from ._cache import (
+    invalidate_rooms_listing, 
+    lookup_room_details, 
+    store_room_details, 
+    invalidate_room_details
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Allocation queries, kept as constants so asyncpg reuses their prepared statements
+# Only the user fields room_allocation_service reads
+SCORING_COLUMNS = """
+    id, name, sleep_schedule, cleanliness_level, noise_tolerance,
+    social_preference, pet_preference, budget_range, location_preference
+"""
+
+UNASSIGNED_USERS_SQL = f"""
+    SELECT {SCORING_COLUMNS}
+    FROM users u
+    WHERE NOT EXISTS (
+        SELECT 1 
+        FROM room_assignments ra 
+        WHERE ra.user_id = u.id AND ra.status = 'active'
+    )
+"""
+
+USER_BY_ID_SQL = f"""
+    SELECT {SCORING_COLUMNS}
+    FROM users WHERE id = $1
+"""
+
+AVAILABLE_ROOMS_SQL = """
+    SELECT id, room_number, floor_number, room_type, capacity, 
+           monthly_rent, amenities
+    FROM rooms 
+    WHERE is_occupied = FALSE
+"""
+
 @router.post("/allocate-rooms/")
 async def allocate_rooms(
     strategy: str = "balanced",
@@ -25,23 +60,10 @@ async def allocate_rooms(
     """
     try:
         # Get all users without room assignments
-        users = await db.fetch("""
-            SELECT u.id, u.name, u.age, u.gender, u.occupation, u.sleep_schedule,
-                   u.cleanliness_level, u.noise_tolerance, u.social_preference,
-                   u.hobbies, u.dietary_restrictions, u.pet_preference,
-                   u.smoking_preference, u.budget_range, u.location_preference
-            FROM users u
-            LEFT JOIN room_assignments ra ON u.id = ra.user_id AND ra.status = 'active'
-            WHERE ra.id IS NULL
-        """)
+        users = await db.fetch(UNASSIGNED_USERS_SQL)
         
         # Get all available rooms
-        rooms = await db.fetch("""
-            SELECT id, room_number, floor_number, room_type, capacity, 
-                   monthly_rent, amenities, is_occupied
-            FROM rooms 
-            WHERE is_occupied = FALSE
-        """)
+        rooms = await db.fetch(AVAILABLE_ROOMS_SQL)
         
         if not users:
             return {
@@ -57,12 +79,8 @@ async def allocate_rooms(
                 "allocations": []
             }
         
-        # Convert to dictionaries
-        users_list = [dict(user) for user in users]
-        rooms_list = [dict(room) for room in rooms]
-        
-        # Perform allocation
-        result = await room_allocation_service.allocate_rooms(users_list, rooms_list, strategy)
+        # Perform allocation; asyncpg Records support the mapping access the service uses
+        result = await room_allocation_service.allocate_rooms(users, rooms, strategy)
         
         if result["success"]:
             # Store allocations in database
@@ -102,24 +120,13 @@ async def allocate_single_user(
             }
         
         # Get user data
-        user = await db.fetchrow("""
-            SELECT id, name, age, gender, occupation, sleep_schedule,
-                   cleanliness_level, noise_tolerance, social_preference,
-                   hobbies, dietary_restrictions, pet_preference,
-                   smoking_preference, budget_range, location_preference
-            FROM users WHERE id = $1
-        """, user_id)
+        user = await db.fetchrow(USER_BY_ID_SQL, user_id)
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Get available rooms
-        rooms = await db.fetch("""
-            SELECT id, room_number, floor_number, room_type, capacity, 
-                   monthly_rent, amenities, is_occupied
-            FROM rooms 
-            WHERE is_occupied = FALSE
-        """)
+        rooms = await db.fetch(AVAILABLE_ROOMS_SQL)
         
         if not rooms:
             return {
@@ -128,12 +135,8 @@ async def allocate_single_user(
                 "allocations": []
             }
         
-        # Convert to lists
-        users_list = [dict(user)]
-        rooms_list = [dict(room) for room in rooms]
-        
         # Perform allocation
-        result = await room_allocation_service.allocate_rooms(users_list, rooms_list, strategy)
+        result = await room_allocation_service.allocate_rooms([user], rooms, strategy)
         
         if result["success"] and result["allocations"]:
             # Store allocation in database
@@ -153,40 +156,25 @@ async def get_allocation_status(db: asyncpg.Connection = Depends(get_db)):
     Get current room allocation status
     """
     try:
-        # Get total users
-        total_users = await db.fetchval("SELECT COUNT(*) FROM users")
-        
-        # Get users with active room assignments
-        assigned_users = await db.fetchval("""
-            SELECT COUNT(DISTINCT user_id) 
-            FROM room_assignments 
-            WHERE status = 'active'
-        """)
-        
-        # Get total rooms
-        total_rooms = await db.fetchval("SELECT COUNT(*) FROM rooms")
-        
-        # Get occupied rooms
-        occupied_rooms = await db.fetchval("""
-            SELECT COUNT(*) FROM rooms WHERE is_occupied = TRUE
+        # Get user and room counts in a single round trip
+        stats = await db.fetchrow("""
+            SELECT 
+                (SELECT COUNT(*) FROM users) AS total_users,
+                (SELECT COUNT(DISTINCT user_id) 
+                 FROM room_assignments 
+                 WHERE status = 'active') AS assigned_users,
+                COUNT(*) AS total_rooms,
+                COUNT(*) FILTER (WHERE is_occupied = TRUE) AS occupied_rooms
+            FROM rooms
         """)
+        total_users = stats['total_users']
+        assigned_users = stats['assigned_users']
+        total_rooms = stats['total_rooms']
+        occupied_rooms = stats['occupied_rooms']
         
         # Get available rooms
         available_rooms = total_rooms - occupied_rooms
         
-        # Get allocation statistics by strategy
-        strategy_stats = await db.fetch("""
-            SELECT 
-                COUNT(*) as count,
-                CASE 
-                    WHEN ra.id IS NULL THEN 'unassigned'
-                    ELSE 'assigned'
-                END as status
-            FROM users u
-            LEFT JOIN room_assignments ra ON u.id = ra.user_id AND ra.status = 'active'
-            GROUP BY ra.id IS NULL
-        """)
-        
         return {
             "total_users": total_users,
             "assigned_users": assigned_users,
@@ -208,6 +196,11 @@ async def get_room_details(room_id: int, db: asyncpg.Connection = Depends(get_db
     Get detailed information about a specific room and its occupants
     """
     try:
+        # Serve recent results from the cache
+        cached = lookup_room_details(room_id)
+        if cached is not None:
+            return cached
+        
         # Get room information
         room = await db.fetchrow("""
             SELECT id, room_number, floor_number, room_type, capacity, 
@@ -228,13 +221,17 @@ async def get_room_details(room_id: int, db: asyncpg.Connection = Depends(get_db
             ORDER BY ra.assigned_at
         """, room_id)
         
-        return {
+        details = {
             "room": dict(room),
             "occupants": [dict(occupant) for occupant in occupants],
             "occupancy_count": len(occupants),
             "available_spots": room['capacity'] - len(occupants)
         }
         
+        store_room_details(room_id, details)
+        
+        return details
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -247,47 +244,53 @@ async def remove_room_assignment(user_id: int, db: asyncpg.Connection = Depends(
     Remove a user's room assignment
     """
     try:
-        # Check if user has an active assignment
-        assignment = await db.fetchrow("""
-            SELECT ra.id, ra.room_id, r.room_number
-            FROM room_assignments ra
-            JOIN rooms r ON ra.room_id = r.id
-            WHERE ra.user_id = $1 AND ra.status = 'active'
+        # Deactivate the user's active assignments and free rooms left empty, atomically
+        # (CTEs share one snapshot, so the deactivated rows are excluded explicitly)
+        assignments = await db.fetch("""
+            WITH removed AS (
+                UPDATE room_assignments 
+                SET status = 'inactive' 
+                WHERE user_id = $1 AND status = 'active'
+                RETURNING id, room_id
+            ), emptied AS (
+                UPDATE rooms 
+                SET is_occupied = FALSE 
+                FROM removed
+                WHERE rooms.id = removed.room_id
+                  AND NOT EXISTS (
+                      SELECT 1 
+                      FROM room_assignments ra 
+                      WHERE ra.room_id = removed.room_id 
+                        AND ra.status = 'active'
+                        AND ra.id NOT IN (SELECT id FROM removed)
+                  )
+                RETURNING rooms.id
+            )
+            SELECT removed.room_id, r.room_number
+            FROM removed
+            JOIN rooms r ON removed.room_id = r.id
+            ORDER BY r.room_number
         """, user_id)
         
-        if not assignment:
+        if not assignments:
             return {
                 "success": False,
                 "message": "User has no active room assignment"
             }
         
-        # Update assignment status
-        await db.execute("""
-            UPDATE room_assignments 
-            SET status = 'inactive' 
-            WHERE id = $1
-        """, assignment['id'])
-        
-        # Check if room is now empty
-        remaining_occupants = await db.fetchval("""
-            SELECT COUNT(*) 
-            FROM room_assignments 
-            WHERE room_id = $1 AND status = 'active'
-        """, assignment['room_id'])
-        
-        # Update room occupancy status
-        if remaining_occupants == 0:
-            await db.execute("""
-                UPDATE rooms 
-                SET is_occupied = FALSE 
-                WHERE id = $1
-            """, assignment['room_id'])
+        invalidate_room_details([assignment['room_id'] for assignment in assignments])
+        invalidate_rooms_listing()
         
+        room_numbers = ", ".join(assignment['room_number'] for assignment in assignments)
         return {
             "success": True,
-            "message": f"Removed assignment from room {assignment['room_number']}",
-            "room_id": assignment['room_id'],
-            "room_number": assignment['room_number']
+            "message": f"Removed assignment from room {room_numbers}",
+            "room_id": assignments[0]['room_id'],
+            "room_number": assignments[0]['room_number'],
+            "removed_assignments": [
+                {"room_id": assignment['room_id'], "room_number": assignment['room_number']}
+                for assignment in assignments
+            ]
         }
         
     except Exception as e:
@@ -299,24 +302,40 @@ async def _store_allocations(allocations: List[Dict[str, Any]], db: asyncpg.Conn
     Store room allocations in the database
     """
     try:
-        for allocation in allocations:
-            if allocation.get('assigned') and allocation.get('room_id'):
-                # Insert room assignment
-                await db.execute("""
-                    INSERT INTO room_assignments (user_id, room_id, status)
-                    VALUES ($1, $2, 'active')
-                    ON CONFLICT (user_id, room_id) 
-                    DO UPDATE SET status = 'active', assigned_at = CURRENT_TIMESTAMP
-                """, allocation['user_id'], allocation['room_id'])
-                
-                # Update room occupancy
-                await db.execute("""
-                    UPDATE rooms 
-                    SET is_occupied = TRUE 
-                    WHERE id = $1
-                """, allocation['room_id'])
-                
-                logger.info(f"Assigned user {allocation['user_id']} to room {allocation['room_id']}")
+        assignments = [
+            (allocation['user_id'], allocation['room_id'])
+            for allocation in allocations
+            if allocation.get('assigned') and allocation.get('room_id')
+        ]
+        if not assignments:
+            return
+        
+        # One upsert can touch each (user, room) pair only once
+        assignments = list(dict.fromkeys(assignments))
+        user_ids, room_ids = (list(column) for column in zip(*assignments))
+        
+        async with db.transaction():
+            # Insert all room assignments in one statement
+            await db.execute("""
+                INSERT INTO room_assignments (user_id, room_id, status)
+                SELECT user_id, room_id, 'active'
+                FROM unnest($1::int[], $2::int[]) AS t(user_id, room_id)
+                ON CONFLICT (user_id, room_id) 
+                DO UPDATE SET status = 'active', assigned_at = CURRENT_TIMESTAMP
+            """, user_ids, room_ids)
+            
+            # Update room occupancy
+            await db.execute("""
+                UPDATE rooms 
+                SET is_occupied = TRUE 
+                WHERE id = ANY($1::int[])
+            """, list(set(room_ids)))
+        
+        invalidate_room_details(room_ids)
+        invalidate_rooms_listing()
+        
+        for user_id, room_id in assignments:
+            logger.info(f"Assigned user {user_id} to room {room_id}")
         
     except Exception as e:
         logger.error(f"Error storing allocations: {e}")
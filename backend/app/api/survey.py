@@ -1,22 +1,154 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import json
 import asyncpg
 import logging
+import time
 from datetime import datetime
-from typing import List
+from typing import List, Dict, Any, Optional, Set, Tuple
 
 from ..models.schemas import (
     OmnidimSurveySubmission, 
     UserResponse, 
+    RoomResponse, 
     EmbeddingRequest, 
     EmbeddingResponse
 )
+from ..database import db as database
 from ..database.db import get_db
-from ..services.embedding_service import generate_embedding
+from ..services.embedding_service import generate_embedding, generate_embeddings_batch
+from ..services.ml_service import ml_service
+from ._cache import get_rooms_listing, set_rooms_listing, lookup_user, store_user, invalidate_users
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Survey answer columns, in the order submissions provide them
+SURVEY_COLUMNS = [
+    'name', 'age', 'gender', 'occupation', 'sleep_schedule', 'cleanliness_level',
+    'noise_tolerance', 'social_preference', 'hobbies', 'dietary_restrictions',
+    'pet_preference', 'smoking_preference', 'budget_range', 'location_preference'
+]
+
+# Columns of a UserResponse, shared by every query that returns one
+USER_RESPONSE_COLUMNS = ", ".join(['id', *SURVEY_COLUMNS, 'created_at', 'updated_at'])
+
+# Survey queries, kept as constants so asyncpg reuses their prepared statements
+INSERT_USER_SQL = f"""
+    INSERT INTO users ({", ".join(SURVEY_COLUMNS)})
+    VALUES ({", ".join(f"${i}" for i in range(1, len(SURVEY_COLUMNS) + 1))})
+    RETURNING {USER_RESPONSE_COLUMNS}
+"""
+
+USERS_SQL = f"""
+    SELECT {USER_RESPONSE_COLUMNS}
+    FROM users
+    ORDER BY created_at DESC
+"""
+
+USER_BY_ID_SQL = f"""
+    SELECT {USER_RESPONSE_COLUMNS}
+    FROM users
+    WHERE id = $1
+"""
+
+SET_SURVEY_EMBEDDING_SQL = "UPDATE users SET embedding_vector = $1, text_hash = NULL WHERE id = $2"
+
+SET_EMBEDDING_SQL = "UPDATE users SET embedding_vector = $1, text_hash = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = $2"
+
+# Columns written by the bulk COPY ingest, in record order
+BULK_USER_COLUMNS = [*SURVEY_COLUMNS, 'embedding_vector']
+
+ROOMS_SQL = """
+    SELECT id, room_number, floor_number, room_type, capacity, 
+           monthly_rent, amenities, is_occupied, created_at
+    FROM rooms
+    ORDER BY room_number
+"""
+
+# Users read from the cursor per chunk of the streamed /users/ listing
+USERS_STREAM_CHUNK_SIZE = 500
+
+# Static part of the Omnidim.io webhook status, served as pre-encoded JSON
+WEBHOOK_STATUS = {
+    "status": "active",
+    "endpoint": "/api/v1/survey-submission/",
+    "method": "POST",
+    "content_type": "application/json",
+    "supported_fields": [
+        "session_id", "user_id", "voice_data", "name", "age", "gender",
+        "occupation", "sleep_schedule", "cleanliness_level", "noise_tolerance",
+        "social_preference", "hobbies", "dietary_restrictions", "pet_preference",
+        "smoking_preference", "budget_range", "location_preference",
+        "confidence_score", "language", "timestamp"
+    ]
+}
+WEBHOOK_STATUS_TTL = 60.0  # seconds
+_webhook_status: Optional[Tuple[float, bytes]] = None  # (encoded_at, body)
+
+# Survey embeddings are queued and generated in small batches off the request path
+EMBEDDING_BATCH_SIZE = 16
+EMBEDDING_BATCH_WAIT = 0.05  # seconds to wait for more jobs after the first
+EMBEDDING_DRAIN_TIMEOUT = 10.0  # seconds shutdown waits for queued embeddings
+_embedding_queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()  # (user_id, hobbies)
+_embedding_in_flight: Set[int] = set()  # user ids of the batch being embedded
+
+async def embedding_worker():
+    """
+    Embed queued survey submissions in batches and store them
+    
+    Runs for the life of the app; started from the startup event.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        # Take the first job, then whatever else arrives within the batch window
+        jobs = [await _embedding_queue.get()]
+        deadline = loop.time() + EMBEDDING_BATCH_WAIT
+        while len(jobs) < EMBEDDING_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                jobs.append(await asyncio.wait_for(_embedding_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        user_ids = [user_id for user_id, _ in jobs]
+        _embedding_in_flight.update(user_ids)
+        try:
+            embeddings = await generate_embeddings_batch([hobbies for _, hobbies in jobs])
+            
+            async with database.pool.acquire() as conn:
+                await conn.executemany(SET_SURVEY_EMBEDDING_SQL, list(zip(embeddings, user_ids)))
+            
+            ml_service.invalidate_embedding_matrix()
+            invalidate_users(user_ids)
+            logger.info(f"Generated embeddings for users {user_ids}")
+            
+        except Exception as e:
+            logger.warning(f"Failed to generate embeddings for users {user_ids}: {e}")
+            # Continue without embeddings - they can be generated later
+        finally:
+            _embedding_in_flight.difference_update(user_ids)
+            for _ in jobs:
+                _embedding_queue.task_done()
+
+async def drain_embedding_queue():
+    """
+    Wait for queued survey embeddings to be stored before shutdown
+    
+    Gives up after EMBEDDING_DRAIN_TIMEOUT and logs the users left without embeddings.
+    """
+    try:
+        await asyncio.wait_for(_embedding_queue.join(), EMBEDDING_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        user_ids = sorted(_embedding_in_flight)
+        while not _embedding_queue.empty():
+            user_ids.append(_embedding_queue.get_nowait()[0])
+            _embedding_queue.task_done()
+        logger.warning(f"Shutting down before embeddings were generated for users {user_ids}")
+
 @router.post("/survey-submission/", response_model=UserResponse)
 async def submit_survey(
     survey_data: OmnidimSurveySubmission,
@@ -27,26 +159,15 @@ async def submit_survey(
     
     This endpoint receives structured data from the Omnidim.io voice assistant
     and stores it in the database. It also triggers embedding generation for
-    the hobbies field to enable AI-powered matching.
+    the hobbies field to enable AI-powered matching; the embedding is generated
+    by the background embedding worker, so it is not yet populated when this returns.
     """
     try:
         logger.info(f"Received survey submission from Omnidim.io session: {survey_data.session_id}")
         
         # Insert user data into database
-        query = """
-            INSERT INTO users (
-                name, age, gender, occupation, sleep_schedule, cleanliness_level,
-                noise_tolerance, social_preference, hobbies, dietary_restrictions,
-                pet_preference, smoking_preference, budget_range, location_preference
-            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
-            RETURNING id, name, age, gender, occupation, sleep_schedule, cleanliness_level,
-                      noise_tolerance, social_preference, hobbies, dietary_restrictions,
-                      pet_preference, smoking_preference, budget_range, location_preference,
-                      created_at, updated_at
-        """
-        
         user_data = await db.fetchrow(
-            query,
+            INSERT_USER_SQL,
             survey_data.name,
             survey_data.age,
             survey_data.gender.value,
@@ -65,21 +186,8 @@ async def submit_survey(
         
         user_id = user_data['id']
         
-        # Generate embedding for hobbies (async task)
-        try:
-            embedding = await generate_embedding(survey_data.hobbies)
-            
-            # Update user with embedding
-            await db.execute(
-                "UPDATE users SET embedding_vector = $1 WHERE id = $2",
-                embedding, user_id
-            )
-            
-            logger.info(f"Generated embedding for user {user_id}")
-            
-        except Exception as e:
-            logger.warning(f"Failed to generate embedding for user {user_id}: {e}")
-            # Continue without embedding - it can be generated later
+        # Queue embedding generation for hobbies without holding up the response
+        _embedding_queue.put_nowait((user_id, survey_data.hobbies))
         
         # Log Omnidim.io specific data
         if survey_data.voice_data:
@@ -88,109 +196,132 @@ async def submit_survey(
         if survey_data.confidence_score:
             logger.info(f"Voice confidence score: {survey_data.confidence_score}")
         
-        return UserResponse(
-            id=user_data['id'],
-            name=user_data['name'],
-            age=user_data['age'],
-            gender=survey_data.gender,
-            occupation=user_data['occupation'],
-            sleep_schedule=survey_data.sleep_schedule,
-            cleanliness_level=survey_data.cleanliness_level,
-            noise_tolerance=survey_data.noise_tolerance,
-            social_preference=survey_data.social_preference,
-            hobbies=user_data['hobbies'],
-            dietary_restrictions=user_data['dietary_restrictions'],
-            pet_preference=survey_data.pet_preference,
-            smoking_preference=survey_data.smoking_preference,
-            budget_range=user_data['budget_range'],
-            location_preference=user_data['location_preference'],
-            created_at=user_data['created_at'],
-            updated_at=user_data['updated_at']
-        )
+        # Enum columns are coerced once, by response_model validation
+        return dict(user_data)
         
     except Exception as e:
         logger.error(f"Error processing survey submission: {e}")
         raise HTTPException(status_code=500, detail="Failed to process survey submission")
 
-@router.get("/users/", response_model=List[UserResponse])
-async def get_users(db: asyncpg.Connection = Depends(get_db)):
-    """Get all users (for testing and admin purposes)"""
+@router.post("/survey-submission/bulk/")
+async def submit_surveys_bulk(
+    submissions: List[OmnidimSurveySubmission],
+    db: asyncpg.Connection = Depends(get_db)
+):
+    """
+    Submit many Omnidim.io survey results at once (session replays and imports)
+    
+    Hobbies embeddings are generated in one batch and all users are written
+    with a single binary COPY instead of one INSERT per submission.
+    """
     try:
-        query = """
-            SELECT id, name, age, gender, occupation, sleep_schedule, cleanliness_level,
-                   noise_tolerance, social_preference, hobbies, dietary_restrictions,
-                   pet_preference, smoking_preference, budget_range, location_preference,
-                   created_at, updated_at
-            FROM users
-            ORDER BY created_at DESC
-        """
+        if not submissions:
+            return {
+                "message": "No submissions received",
+                "inserted_count": 0,
+                "status": "completed"
+            }
+        
+        logger.info(f"Received {len(submissions)} bulk survey submissions from Omnidim.io")
         
-        users = await db.fetch(query)
+        embeddings = await generate_embeddings_batch([survey_data.hobbies for survey_data in submissions])
         
-        return [
-            UserResponse(
-                id=user['id'],
-                name=user['name'],
-                age=user['age'],
-                gender=user['gender'],
-                occupation=user['occupation'],
-                sleep_schedule=user['sleep_schedule'],
-                cleanliness_level=user['cleanliness_level'],
-                noise_tolerance=user['noise_tolerance'],
-                social_preference=user['social_preference'],
-                hobbies=user['hobbies'],
-                dietary_restrictions=user['dietary_restrictions'],
-                pet_preference=user['pet_preference'],
-                smoking_preference=user['smoking_preference'],
-                budget_range=user['budget_range'],
-                location_preference=user['location_preference'],
-                created_at=user['created_at'],
-                updated_at=user['updated_at']
+        records = [
+            (
+                survey_data.name,
+                survey_data.age,
+                survey_data.gender.value,
+                survey_data.occupation,
+                survey_data.sleep_schedule.value,
+                survey_data.cleanliness_level.value,
+                survey_data.noise_tolerance.value,
+                survey_data.social_preference.value,
+                survey_data.hobbies,
+                survey_data.dietary_restrictions,
+                survey_data.pet_preference.value,
+                survey_data.smoking_preference.value,
+                survey_data.budget_range,
+                survey_data.location_preference,
+                embedding
             )
-            for user in users
+            for survey_data, embedding in zip(submissions, embeddings)
         ]
         
+        await db.copy_records_to_table('users', records=records, columns=BULK_USER_COLUMNS)
+        ml_service.invalidate_embedding_matrix()
+        
+        return {
+            "message": f"Successfully stored {len(records)} survey submissions",
+            "inserted_count": len(records),
+            "status": "completed"
+        }
+        
     except Exception as e:
-        logger.error(f"Error fetching users: {e}")
+        logger.error(f"Error processing bulk survey submission: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process bulk survey submission")
+
+@router.get(
+    "/users/",
+    response_class=StreamingResponse,
+    responses={200: {"model": List[UserResponse], "description": "All users, newest first"}}
+)
+async def get_users():
+    """
+    Get all users (for testing and admin purposes)
+    
+    Users are read through a cursor and streamed as one JSON array, so memory
+    stays bounded by USERS_STREAM_CHUNK_SIZE rows and the first bytes go out
+    before the whole table has been read.
+    """
+    if database.pool is None:
+        logger.error("Error fetching users: database pool not initialized")
         raise HTTPException(status_code=500, detail="Failed to fetch users")
+    
+    return StreamingResponse(_stream_users(), media_type="application/json")
+
+async def _stream_users():
+    """
+    Yield the user listing as chunks of a JSON array, validated like UserResponse
+    """
+    # The request's connection is released before a streamed body is sent
+    try:
+        async with database.pool.acquire() as conn:
+            async with conn.transaction():
+                cursor = await conn.cursor(USERS_SQL)
+                separator = b""
+                yield b"["
+                while True:
+                    users = await cursor.fetch(USERS_STREAM_CHUNK_SIZE)
+                    if not users:
+                        break
+                    yield separator + b",".join(
+                        UserResponse.model_validate(dict(user)).model_dump_json().encode("utf-8")
+                        for user in users
+                    )
+                    separator = b","
+                yield b"]"
+    except Exception as e:
+        # Headers are already sent, so the client only sees the body end early
+        logger.error(f"Error streaming users: {e}")
+        raise
 
 @router.get("/users/{user_id}", response_model=UserResponse)
 async def get_user(user_id: int, db: asyncpg.Connection = Depends(get_db)):
     """Get a specific user by ID"""
     try:
-        query = """
-            SELECT id, name, age, gender, occupation, sleep_schedule, cleanliness_level,
-                   noise_tolerance, social_preference, hobbies, dietary_restrictions,
-                   pet_preference, smoking_preference, budget_range, location_preference,
-                   created_at, updated_at
-            FROM users
-            WHERE id = $1
-        """
+        cached = lookup_user(user_id)
+        if cached is not None:
+            return cached
         
-        user = await db.fetchrow(query, user_id)
+        user = await db.fetchrow(USER_BY_ID_SQL, user_id)
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        return UserResponse(
-            id=user['id'],
-            name=user['name'],
-            age=user['age'],
-            gender=user['gender'],
-            occupation=user['occupation'],
-            sleep_schedule=user['sleep_schedule'],
-            cleanliness_level=user['cleanliness_level'],
-            noise_tolerance=user['noise_tolerance'],
-            social_preference=user['social_preference'],
-            hobbies=user['hobbies'],
-            dietary_restrictions=user['dietary_restrictions'],
-            pet_preference=user['pet_preference'],
-            smoking_preference=user['smoking_preference'],
-            budget_range=user['budget_range'],
-            location_preference=user['location_preference'],
-            created_at=user['created_at'],
-            updated_at=user['updated_at']
-        )
+        user = dict(user)
+        store_user(user_id, user)
+        
+        return user
         
     except HTTPException:
         raise
@@ -210,23 +341,21 @@ async def generate_user_embedding(
     or to regenerate embeddings if needed.
     """
     try:
-        import time
         start_time = time.time()
         
         # Generate embedding
         embedding = await generate_embedding(request.hobbies_text)
         
         # Update user's embedding in database
-        await db.execute(
-            "UPDATE users SET embedding_vector = $1, updated_at = $2 WHERE id = $3",
-            embedding, datetime.utcnow(), request.user_id
-        )
+        await db.execute(SET_EMBEDDING_SQL, embedding, request.user_id)
+        ml_service.invalidate_embedding_matrix()
+        invalidate_users([request.user_id])
         
         processing_time = time.time() - start_time
         
         return EmbeddingResponse(
             user_id=request.user_id,
-            embedding_vector=embedding,
+            embedding_vector=embedding.tolist(),
             vector_dimension=len(embedding),
             processing_time=processing_time
         )
@@ -243,48 +372,33 @@ async def get_omnidim_webhook_status():
     This endpoint provides information about the current state
     of the Omnidim.io voice assistant integration.
     """
-    return {
-        "status": "active",
-        "endpoint": "/api/v1/survey-submission/",
-        "method": "POST",
-        "content_type": "application/json",
-        "supported_fields": [
-            "session_id", "user_id", "voice_data", "name", "age", "gender",
-            "occupation", "sleep_schedule", "cleanliness_level", "noise_tolerance",
-            "social_preference", "hobbies", "dietary_restrictions", "pet_preference",
-            "smoking_preference", "budget_range", "location_preference",
-            "confidence_score", "language", "timestamp"
-        ],
-        "last_updated": datetime.utcnow().isoformat()
-    }
+    global _webhook_status
+    
+    # The body only changes with last_updated, so it is re-encoded at most once a minute
+    now = time.monotonic()
+    if _webhook_status is None or now - _webhook_status[0] > WEBHOOK_STATUS_TTL:
+        body = json.dumps(
+            {**WEBHOOK_STATUS, "last_updated": datetime.utcnow().isoformat()},
+            separators=(",", ":")
+        ).encode("utf-8")
+        _webhook_status = (now, body)
+    
+    return Response(content=_webhook_status[1], media_type="application/json")
 
-@router.get("/rooms/")
+@router.get("/rooms/", response_model=List[RoomResponse])
 async def get_rooms(db: asyncpg.Connection = Depends(get_db)):
     """Get all rooms (for admin purposes)"""
     try:
-        query = """
-            SELECT id, room_number, floor_number, room_type, capacity, 
-                   monthly_rent, amenities, is_occupied, created_at
-            FROM rooms
-            ORDER BY room_number
-        """
-        
-        rooms = await db.fetch(query)
+        rooms = get_rooms_listing()
+        if rooms is None:
+            # The response model serializes Decimal rent and datetimes directly
+            rooms = [
+                {**room, "monthly_rent": room['monthly_rent'] or 0}
+                for room in await db.fetch(ROOMS_SQL)
+            ]
+            set_rooms_listing(rooms)
         
-        return [
-            {
-                "id": room['id'],
-                "room_number": room['room_number'],
-                "floor_number": room['floor_number'],
-                "room_type": room['room_type'],
-                "capacity": room['capacity'],
-                "monthly_rent": float(room['monthly_rent']) if room['monthly_rent'] else 0,
-                "amenities": room['amenities'],
-                "is_occupied": room['is_occupied'],
-                "created_at": room['created_at'].isoformat() if room['created_at'] else None
-            }
-            for room in rooms
-        ]
+        return rooms
         
     except Exception as e:
         logger.error(f"Error fetching rooms: {e}")
@@ -1,18 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
+import asyncio
+import os
 from datetime import datetime
 import logging
 
 # Import our modules
+from .database import db as database
 from .database.db import get_db, init_db
-from .api.survey import router as survey_router
+from .api.survey import router as survey_router, embedding_worker, drain_embedding_queue
 from .api.matching import router as matching_router
 from .api.preprocessing import router as preprocessing_router
 from .api.ml_training import router as ml_training_router
 from .api.room_allocation import router as room_allocation_router
+from .services.ml_service import ml_service
+from .services.embedding_service import get_model_async
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,15 +30,25 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# CORS middleware for frontend integration
+# CORS middleware for frontend integration; a concrete origin list is required
+# alongside credentials and lets Starlette answer with precomputed headers
+CORS_ORIGINS = [
+    origin.strip()
+    for origin in os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
+    if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "authorization"],
 )
 
+# Compress larger JSON responses such as user and room listings
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=1)
+
 # Include routers
 app.include_router(survey_router, prefix="/api/v1", tags=["survey"])
 app.include_router(matching_router, prefix="/api/v1", tags=["matching"])
@@ -49,6 +65,29 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"Database initialization failed: {e}")
         logger.info("Server starting without database connection")
+        return
+    
+    try:
+        # Warm the embedding matrix cache used by the matching endpoints
+        async with database.pool.acquire() as conn:
+            await ml_service.refresh_embedding_matrix(conn)
+    except Exception as e:
+        logger.warning(f"Embedding cache warm-up failed: {e}")
+    
+    # Load the Sentence-BERT model now rather than on the first embedding request
+    await get_model_async()
+    
+    # Generate survey embeddings in batches off the request path
+    app.state.embedding_worker = asyncio.create_task(embedding_worker())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers"""
+    worker = getattr(app.state, "embedding_worker", None)
+    if worker is not None:
+        # Let queued survey embeddings finish before the worker goes away
+        await drain_embedding_queue()
+        worker.cancel()
 
 @app.get("/")
 async def root():
@@ -74,10 +113,15 @@ async def health_check():
     }
 
 if __name__ == "__main__":
+    # uvloop and httptools ship with uvicorn[standard]; reload only makes sense in development
+    debug = os.getenv("DEBUG", "false").lower() == "true"
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=debug,
+        workers=None if debug else int(os.getenv("API_WORKERS", "1")),
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     ) 
\ No newline at end of file
@@ -100,6 +100,18 @@ class UserResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class RoomResponse(BaseModel):
+    """Response model for room listings"""
+    id: int
+    room_number: str
+    floor_number: Optional[int]
+    room_type: Optional[str]
+    capacity: Optional[int]
+    monthly_rent: float
+    amenities: Optional[List[str]]
+    is_occupied: Optional[bool]
+    created_at: Optional[datetime]
+
 class MatchingRequest(BaseModel):
     """Request model for roommate matching"""
     user_id: int = Field(..., description="ID of the user seeking a roommate")
@@ -1,6 +1,9 @@
 import asyncio
+import hashlib
 import logging
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import numpy as np
 
 logger = logging.getLogger(__name__)
@@ -9,6 +12,36 @@ logger = logging.getLogger(__name__)
 _model = None
 _model_name = "all-MiniLM-L6-v2"
 
+# Dedicated worker for model loading and inference. It keeps both off the event loop
+# without competing with other executor work; torch already spreads a batch across cores.
+_model_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+
+# In-process LRU of model embeddings keyed by SHA-256 of the input text
+EMBEDDING_CACHE_SIZE = 10000
+_embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+EMBEDDING_DIMENSION = 384  # Standard dimension for all-MiniLM-L6-v2
+
+def text_hash(text: str) -> bytes:
+    """SHA-256 digest identifying a text for embedding caches"""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+def get_cached_embedding(key: bytes) -> Optional[np.ndarray]:
+    """Return the cached embedding for a text hash, if any"""
+    embedding = _embedding_cache.get(key)
+    if embedding is not None:
+        _embedding_cache.move_to_end(key)
+    return embedding
+
+def cache_embedding(key: bytes, embedding: np.ndarray):
+    """Remember a model embedding for a text hash, evicting the least recently used"""
+    # Cached arrays are shared between callers, so they are frozen
+    embedding = np.asarray(embedding, dtype=np.float32)
+    embedding.flags.writeable = False
+    _embedding_cache[key] = embedding
+    _embedding_cache.move_to_end(key)
+    while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+
 def get_model():
     """Get or create the Sentence-BERT model instance"""
     global _model
@@ -24,7 +57,17 @@ def get_model():
             _model = None
     return _model
 
-async def generate_embedding(text: str) -> List[float]:
+async def get_model_async():
+    """Get the Sentence-BERT model, loading it on the model worker if needed"""
+    if _model is not None:
+        return _model
+    return await asyncio.get_running_loop().run_in_executor(_model_executor, get_model)
+
+def _dummy_embedding() -> np.ndarray:
+    """Placeholder embedding used when Sentence-BERT is not available"""
+    return np.full(EMBEDDING_DIMENSION, 0.1, dtype=np.float32)
+
+async def generate_embedding(text: str) -> np.ndarray:
     """
     Generate embedding for text using Sentence-BERT
     
@@ -32,71 +75,91 @@ async def generate_embedding(text: str) -> List[float]:
         text: Input text (e.g., hobbies description)
         
     Returns:
-        List of floats representing the text embedding
+        float32 array representing the text embedding
     """
     try:
+        # Identical text always yields the same embedding
+        key = text_hash(text)
+        cached = get_cached_embedding(key)
+        if cached is not None:
+            return cached
+        
         # Get the model
-        model = get_model()
+        model = await get_model_async()
         
         if model is None:
             # Fallback to dummy embeddings for development
             logger.warning("Using dummy embeddings - Sentence-BERT not available")
-            return [0.1] * 384  # Standard dimension for all-MiniLM-L6-v2
+            return _dummy_embedding()
         
-        # Run embedding generation in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
+        # Run embedding generation on the model worker to avoid blocking
+        loop = asyncio.get_running_loop()
         embedding = await loop.run_in_executor(
-            None, 
+            _model_executor, 
             lambda: model.encode(text, convert_to_tensor=False)
         )
         
-        # Convert to list of floats
-        embedding_list = embedding.tolist()
+        # Keep float32 so the pgvector binary codec sends it without conversion
+        embedding = np.asarray(embedding, dtype=np.float32)
         
-        logger.debug(f"Generated embedding of dimension {len(embedding_list)} for text: {text[:50]}...")
+        logger.debug(f"Generated embedding of dimension {len(embedding)} for text: {text[:50]}...")
         
-        return embedding_list
+        cache_embedding(key, embedding)
+        return embedding
         
     except Exception as e:
         logger.error(f"Error generating embedding: {e}")
         # Fallback to dummy embeddings
-        return [0.1] * 384
+        return _dummy_embedding()
 
-async def generate_embeddings_batch(texts: List[str]) -> List[List[float]]:
+async def generate_embeddings_batch(texts: List[str], batch_size: int = 64) -> List[np.ndarray]:
     """
     Generate embeddings for multiple texts in batch
     
     Args:
         texts: List of input texts
+        batch_size: Number of texts encoded per forward pass
         
     Returns:
-        List of embeddings
+        List of float32 embedding arrays
     """
     try:
-        model = get_model()
+        model = await get_model_async()
         
         if model is None:
             # Fallback to dummy embeddings for development
             logger.warning("Using dummy embeddings - Sentence-BERT not available")
-            return [[0.1] * 384 for _ in texts]
+            return [_dummy_embedding() for _ in texts]
         
-        loop = asyncio.get_event_loop()
-        embeddings = await loop.run_in_executor(
-            None,
-            lambda: model.encode(texts, convert_to_tensor=False)
-        )
+        # Only encode texts that are not already cached
+        keys = [text_hash(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [get_cached_embedding(key) for key in keys]
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
         
-        return embeddings.tolist()
+        if missing:
+            loop = asyncio.get_running_loop()
+            embeddings = await loop.run_in_executor(
+                _model_executor,
+                lambda: model.encode([texts[i] for i in missing], batch_size=batch_size, convert_to_numpy=True)
+            )
+            
+            for i, embedding in zip(missing, np.asarray(embeddings, dtype=np.float32)):
+                cache_embedding(keys[i], embedding)
+                results[i] = get_cached_embedding(keys[i])
+        
+        return results
         
     except Exception as e:
         logger.error(f"Error generating batch embeddings: {e}")
         # Fallback to dummy embeddings
-        return [[0.1] * 384 for _ in texts]
+        return [_dummy_embedding() for _ in texts]
 
-async def calculate_similarity(embedding1: List[float], embedding2: List[float]) -> float:
+def calculate_similarity(embedding1: List[float], embedding2: List[float]) -> float:
     """
     Calculate cosine similarity between two embeddings
     
+    This is pure CPU work, so it is a plain function rather than a coroutine.
+    
     Args:
         embedding1: First embedding vector
         embedding2: Second embedding vector
@@ -105,9 +168,9 @@ async def calculate_similarity(embedding1: List[float], embedding2: List[float])
         Similarity score between 0 and 1
     """
     try:
-        # Convert to numpy arrays
-        vec1 = np.array(embedding1)
-        vec2 = np.array(embedding2)
+        # View both vectors as contiguous float32 without copying when already float32
+        vec1 = np.ascontiguousarray(embedding1, dtype=np.float32)
+        vec2 = np.ascontiguousarray(embedding2, dtype=np.float32)
         
         # Calculate cosine similarity
         similarity = np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
@@ -118,6 +181,57 @@ async def calculate_similarity(embedding1: List[float], embedding2: List[float])
         logger.error(f"Error calculating similarity: {e}")
         return 0.0
 
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Scale embeddings to unit length so cosine similarity becomes a dot product
+    
+    Args:
+        embeddings: Single embedding or (N, d) matrix of embeddings
+        
+    Returns:
+        float32 array of the same shape with unit-norm rows
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / (np.linalg.norm(embeddings, axis=-1, keepdims=True) + 1e-12)
+
+def calculate_similarities(query: List[float], embeddings: np.ndarray) -> np.ndarray:
+    """
+    Calculate cosine similarity between one embedding and every row of a matrix
+    
+    Args:
+        query: Embedding vector to compare against
+        embeddings: (N, d) matrix of embeddings
+        
+    Returns:
+        Array of N similarity scores
+    """
+    query = np.asarray(query, dtype=np.float32)
+    query = query / (np.linalg.norm(query) + 1e-12)
+    
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return (embeddings @ query) / (np.linalg.norm(embeddings, axis=1) + 1e-12)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first
+    
+    Uses a partial sort (O(N + k log k)) instead of sorting every score.
+    
+    Args:
+        scores: 1-D array of scores
+        k: Number of indices to return
+        
+    Returns:
+        Array of at most k indices ordered by descending score
+    """
+    scores = np.asarray(scores)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
 async def find_similar_hobbies(target_hobbies: str, all_hobbies: List[str], top_k: int = 5) -> List[tuple]:
     """
     Find hobbies similar to the target hobbies
@@ -137,15 +251,11 @@ async def find_similar_hobbies(target_hobbies: str, all_hobbies: List[str], top_
         # Generate embeddings for all hobbies
         all_embeddings = await generate_embeddings_batch(all_hobbies)
         
-        # Calculate similarities
-        similarities = []
-        for i, embedding in enumerate(all_embeddings):
-            similarity = await calculate_similarity(target_embedding, embedding)
-            similarities.append((all_hobbies[i], similarity))
+        # Calculate all similarities in one batch
+        scores = calculate_similarities(target_embedding, all_embeddings)
         
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities[:top_k]
+        # Partially sort by similarity and return top_k
+        return [(all_hobbies[i], float(scores[i])) for i in top_k_indices(scores, top_k)]
         
     except Exception as e:
         logger.error(f"Error finding similar hobbies: {e}")
@@ -155,18 +265,20 @@ def get_embedding_dimension() -> int:
     """Get the dimension of the embeddings generated by the model"""
     model = get_model()
     if model is None:
-        return 384  # Standard dimension for all-MiniLM-L6-v2
+        return EMBEDDING_DIMENSION
     # Create a dummy embedding to get the dimension
     try:
         dummy_embedding = model.encode("test", convert_to_tensor=False)
         return len(dummy_embedding)
     except Exception:
-        return 384  # Fallback dimension
+        return EMBEDDING_DIMENSION  # Fallback dimension
 
-async def preprocess_hobbies_text(text: str) -> str:
+def preprocess_hobbies_text(text: str) -> str:
     """
     Preprocess hobbies text before embedding generation
     
+    Plain string work, so it is a regular function usable from sync code.
+    
     Args:
         text: Raw hobbies text
         
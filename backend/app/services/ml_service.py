@@ -2,19 +2,94 @@ import asyncio
 import logging
 import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Mapping, Sequence
 from sklearn.neighbors import NearestNeighbors
 from sklearn.decomposition import TruncatedSVD
 from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import StandardScaler, normalize
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, classification_report
-import pickle
+import joblib
+import json
 import os
 from datetime import datetime
+from functools import partial
+
+from .embedding_service import normalize_embeddings
 
 logger = logging.getLogger(__name__)
 
+# Lifestyle columns cached next to the embeddings for vectorized rule-based scoring
+CATEGORICAL_COLUMNS = (
+    'sleep_schedule', 'cleanliness_level', 'noise_tolerance',
+    'social_preference', 'pet_preference', 'smoking_preference'
+)
+
+# Points at the files of the most recently saved models, inside model_path
+MODEL_MANIFEST = "latest.json"
+
+# Feature counts at or below this are not reduced with SVD
+SVD_MIN_FEATURES = 8
+
+# Training sets below this many rows fit the logistic model with liblinear
+LIBLINEAR_MAX_ROWS = 5000
+
+# Every column the embedding cache and model training read, and nothing else
+EMBEDDING_USERS_SQL = """
+    SELECT id, embedding_vector, age, sleep_schedule, cleanliness_level,
+           noise_tolerance, social_preference, pet_preference,
+           smoking_preference
+    FROM users
+    WHERE embedding_vector IS NOT NULL
+    ORDER BY id
+"""
+
+# Numeric encodings of the lifestyle preferences used as model features; unknown values map to 0.5
+SLEEP_ENCODING = {
+    'early_bird': 0.0,
+    'night_owl': 1.0,
+    'flexible': 0.5
+}
+
+CLEANLINESS_ENCODING = {
+    'very_clean': 1.0,
+    'clean': 0.75,
+    'moderate': 0.5,
+    'relaxed': 0.25,
+    'very_relaxed': 0.0
+}
+
+NOISE_ENCODING = {
+    'very_quiet': 0.0,
+    'quiet': 0.25,
+    'moderate': 0.5,
+    'tolerant': 0.75,
+    'very_tolerant': 1.0
+}
+
+SOCIAL_ENCODING = {
+    'very_social': 1.0,
+    'social': 0.75,
+    'moderate': 0.5,
+    'private': 0.25,
+    'very_private': 0.0
+}
+
+# Encoded feature columns, in the order they follow age in the feature vector
+FEATURE_ENCODINGS = (
+    ('sleep_schedule', SLEEP_ENCODING),
+    ('cleanliness_level', CLEANLINESS_ENCODING),
+    ('noise_tolerance', NOISE_ENCODING),
+    ('social_preference', SOCIAL_ENCODING)
+)
+
+# Per encoded column: categorical dtype over its known values and their encodings,
+# with a trailing 0.5 that code -1 (NULL or unknown value) selects
+FEATURE_LOOKUPS = tuple(
+    (column, pd.CategoricalDtype(list(encoding)), np.array([*encoding.values(), 0.5], dtype=np.float32))
+    for column, encoding in FEATURE_ENCODINGS
+)
+
 class RoommateMatchingML:
     """
     Machine Learning service for roommate matching using multiple algorithms
@@ -25,9 +100,23 @@ class RoommateMatchingML:
         self.svd_model = None
         self.logistic_model = None
         self.scaler = StandardScaler()
+        self.training_user_ids: Optional[np.ndarray] = None  # user id of each training row
+        self.test_rows: Optional[np.ndarray] = None  # training rows held out for evaluation
         self.models_trained = False
         self.model_path = "models/"
         
+        # Process-wide cache of user embeddings shared by the matching endpoints
+        self.embedding_matrix: Optional[np.ndarray] = None
+        self.unit_embedding_matrix: Optional[np.ndarray] = None  # rows scaled to unit length
+        self.feature_extras: Optional[np.ndarray] = None  # (N, 5) age + encoded preferences
+        self.user_ids: Optional[np.ndarray] = None
+        self.id_to_row: Dict[int, int] = {}
+        self.category_codes: Dict[str, np.ndarray] = {}  # column -> int8 code per cached row
+        self.category_values: Dict[str, List[Any]] = {}  # column -> value of each code
+        self._embedding_version = 0
+        self._embedding_lock = asyncio.Lock()
+        self._load_lock = asyncio.Lock()
+        
         # Ensure models directory exists
         os.makedirs(self.model_path, exist_ok=True)
     
@@ -49,13 +138,29 @@ class RoommateMatchingML:
                     "users_count": len(users_data)
                 }
             
-            # Prepare training data
-            X, y = await self._prepare_training_data(users_data)
+            # Training already fetched every embedding, so refresh the matching cache for free
+            cache = self._build_embedding_cache(users_data)
+            self._set_embedding_matrix(cache)
             
-            # Train models
-            knn_results = await self._train_knn_model(X, y)
-            svd_results = await self._train_svd_model(X, y)
-            logistic_results = await self._train_logistic_model(X, y)
+            # Prepare training data from the arrays the cache just stacked
+            X, y = await self._prepare_training_data(users_data, cache)
+            self.training_user_ids = np.asarray([user['id'] for user in users_data], dtype=np.int64)
+            
+            # Scale features once; the trainers share the result and never touch the scaler,
+            # so they can run concurrently
+            X = np.ascontiguousarray(X, dtype=np.float32)
+            X_scaled = self.scaler.fit_transform(X)
+            
+            # Split once for every model evaluation; the held-out rows stay on the service
+            train_rows, self.test_rows = self._split_training_rows(y)
+            
+            # Train models in worker threads; sklearn releases the GIL in its numeric kernels
+            loop = asyncio.get_running_loop()
+            knn_results, svd_results, logistic_results = await asyncio.gather(
+                loop.run_in_executor(None, self._train_knn_model, X_scaled),
+                loop.run_in_executor(None, self._train_svd_model, X_scaled),
+                loop.run_in_executor(None, self._train_logistic_model, X, X_scaled, y, train_rows, self.test_rows)
+            )
             
             # Save models
             await self._save_models()
@@ -80,138 +185,96 @@ class RoommateMatchingML:
                 "message": str(e)
             }
     
-    async def _fetch_training_data(self, db_connection) -> List[Dict[str, Any]]:
+    async def _fetch_training_data(self, db_connection) -> List[Mapping[str, Any]]:
         """
         Fetch user data with embeddings for training
-        """
-        users = await db_connection.fetch("""
-            SELECT id, name, age, gender, occupation, sleep_schedule,
-                   cleanliness_level, noise_tolerance, social_preference,
-                   hobbies, dietary_restrictions, pet_preference,
-                   smoking_preference, budget_range, location_preference,
-                   embedding_vector
-            FROM users 
-            WHERE embedding_vector IS NOT NULL
-        """)
         
-        return [dict(user) for user in users]
+        Only the model's columns are read. Rows are used as returned by asyncpg,
+        whose vector codec already decodes embeddings to float32 arrays.
+        """
+        return await db_connection.fetch(EMBEDDING_USERS_SQL)
     
-    async def _prepare_training_data(self, users_data: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    async def _prepare_training_data(
+        self, users_data: Sequence[Mapping[str, Any]], cache: Optional[Dict[str, Any]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Prepare training data for ML models
+        
+        Rows come from EMBEDDING_USERS_SQL, so every user has an embedding. The
+        embedding matrix and encoded extras of `cache` (built from the same rows by
+        `_build_embedding_cache`) are copied into one C-contiguous float32 buffer
+        that sklearn can use without copying, so embeddings are stacked only once.
         """
-        # Extract features
-        features = []
-        labels = []
+        if not users_data:
+            return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int8)
+        
+        if cache is None:
+            cache = self._build_embedding_cache(users_data)
         
-        for user in users_data:
-            # Use embedding vector as primary features
-            if user['embedding_vector']:
-                embedding = np.array(user['embedding_vector'])
-                
-                # Add additional numerical features
-                additional_features = []
-                
-                # Age (normalized)
-                if user['age']:
-                    additional_features.append(user['age'] / 100.0)  # Normalize age
-                else:
-                    additional_features.append(0.5)  # Default age
-                
-                # Categorical features (one-hot encoded)
-                categorical_features = self._encode_categorical_features(user)
-                additional_features.extend(categorical_features)
-                
-                # Combine embedding with additional features
-                combined_features = np.concatenate([embedding, additional_features])
-                features.append(combined_features)
-                
-                # Create compatibility label (simplified for training)
-                # In a real scenario, this would be based on actual compatibility data
-                compatibility_score = self._calculate_compatibility_score(user)
-                labels.append(1 if compatibility_score > 0.7 else 0)
+        # Combine embedding with age and encoded preferences
+        embeddings = cache["embedding_matrix"]
+        dimension = embeddings.shape[1]
+        features = np.empty((len(embeddings), dimension + 1 + len(FEATURE_ENCODINGS)), dtype=np.float32, order='C')
+        features[:, :dimension] = embeddings
+        features[:, dimension:] = cache["feature_extras"]
         
-        return np.array(features), np.array(labels)
+        users = pd.DataFrame({
+            column: pd.Series([user[column] for user in users_data], dtype=object)
+            for column in ('cleanliness_level', 'noise_tolerance', 'social_preference')
+        })
+        
+        # Create compatibility labels (simplified for training)
+        # In a real scenario, this would be based on actual compatibility data
+        labels = (self._calculate_compatibility_scores(users) > 0.7).astype(np.int8)
+        
+        return features, labels
     
-    def _encode_categorical_features(self, user: Dict[str, Any]) -> List[float]:
+    def _encode_feature_extras(self, users: pd.DataFrame) -> np.ndarray:
         """
-        Encode categorical features as numerical values
+        Encode age and lifestyle preferences as the (N, 5) non-embedding features
         """
-        features = []
+        extras = np.empty((len(users), 1 + len(FEATURE_LOOKUPS)), dtype=np.float32)
         
-        # Sleep schedule encoding
-        sleep_encoding = {
-            'early_bird': 0.0,
-            'night_owl': 1.0,
-            'flexible': 0.5
-        }
-        features.append(sleep_encoding.get(user.get('sleep_schedule', 'flexible'), 0.5))
+        # Age (normalized), with missing or zero ages defaulting to 0.5
+        ages = pd.to_numeric(users['age'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        extras[:, 0] = np.where(ages != 0, ages / 100.0, 0.5)
         
-        # Cleanliness level encoding
-        cleanliness_encoding = {
-            'very_clean': 1.0,
-            'clean': 0.75,
-            'moderate': 0.5,
-            'relaxed': 0.25,
-            'very_relaxed': 0.0
-        }
-        features.append(cleanliness_encoding.get(user.get('cleanliness_level', 'moderate'), 0.5))
-        
-        # Noise tolerance encoding
-        noise_encoding = {
-            'very_quiet': 0.0,
-            'quiet': 0.25,
-            'moderate': 0.5,
-            'tolerant': 0.75,
-            'very_tolerant': 1.0
-        }
-        features.append(noise_encoding.get(user.get('noise_tolerance', 'moderate'), 0.5))
+        # Categorical features: one gather of the encoded values by category code
+        for i, (column, dtype, values) in enumerate(FEATURE_LOOKUPS, start=1):
+            extras[:, i] = values[users[column].astype(dtype).cat.codes.to_numpy()]
         
-        # Social preference encoding
-        social_encoding = {
-            'very_social': 1.0,
-            'social': 0.75,
-            'moderate': 0.5,
-            'private': 0.25,
-            'very_private': 0.0
-        }
-        features.append(social_encoding.get(user.get('social_preference', 'moderate'), 0.5))
-        
-        return features
+        return extras
     
-    def _calculate_compatibility_score(self, user: Dict[str, Any]) -> float:
+    def _calculate_compatibility_scores(self, users: pd.DataFrame) -> np.ndarray:
         """
-        Calculate a compatibility score for training purposes
+        Calculate a compatibility score per user for training purposes
         This is a simplified heuristic - in production, this would be based on actual data
         """
-        score = 0.5  # Base score
+        scores = np.full(len(users), 0.5)  # Base score
         
         # Adjust based on preferences
-        if user.get('cleanliness_level') == 'clean':
-            score += 0.1
-        if user.get('noise_tolerance') == 'moderate':
-            score += 0.1
-        if user.get('social_preference') == 'moderate':
-            score += 0.1
+        scores += 0.1 * users['cleanliness_level'].eq('clean').to_numpy()
+        scores += 0.1 * users['noise_tolerance'].eq('moderate').to_numpy()
+        scores += 0.1 * users['social_preference'].eq('moderate').to_numpy()
         
-        return min(score, 1.0)
+        return np.minimum(scores, 1.0)
     
-    async def _train_knn_model(self, X: np.ndarray, y: np.ndarray) -> Dict[str, Any]:
+    def _train_knn_model(self, X_scaled: np.ndarray) -> Dict[str, Any]:
         """
-        Train K-Nearest Neighbors model
+        Train K-Nearest Neighbors model on scaled features
+        
+        Rows are scaled to unit length and indexed with brute-force Euclidean search,
+        which ranks like cosine distance but runs as a single matrix product per query.
         """
         try:
-            # Scale features
-            X_scaled = self.scaler.fit_transform(X)
-            
-            # Train KNN model
-            self.knn_model = NearestNeighbors(n_neighbors=5, algorithm='auto', metric='cosine')
-            self.knn_model.fit(X_scaled)
+            # Train KNN model; normalize into a copy since the other trainers share X_scaled
+            self.knn_model = NearestNeighbors(n_neighbors=5, algorithm='brute', metric='euclidean')
+            self.knn_model.fit(normalize(X_scaled))
             
             return {
                 "algorithm": "K-Nearest Neighbors",
                 "n_neighbors": 5,
-                "metric": "cosine",
+                "metric": "cosine (euclidean on unit vectors)",
                 "status": "trained"
             }
             
@@ -219,18 +282,28 @@ class RoommateMatchingML:
             logger.error(f"Error training KNN model: {e}")
             return {"status": "error", "message": str(e)}
     
-    async def _train_svd_model(self, X: np.ndarray, y: np.ndarray) -> Dict[str, Any]:
+    def _train_svd_model(self, X_scaled: np.ndarray) -> Dict[str, Any]:
         """
-        Train Singular Value Decomposition model for dimensionality reduction
+        Train Singular Value Decomposition model for dimensionality reduction on scaled features
         """
         try:
-            # Scale features
-            X_scaled = self.scaler.fit_transform(X)
+            # Too few features for a reduction to be worth fitting
+            if X_scaled.shape[1] <= SVD_MIN_FEATURES:
+                self.svd_model = None
+                return {
+                    "algorithm": "Singular Value Decomposition",
+                    "status": "skipped",
+                    "reason": f"only {X_scaled.shape[1]} features"
+                }
             
             # Train SVD model
-            n_components = min(50, X_scaled.shape[1] - 1)  # Reduce to 50 components or less
-            self.svd_model = TruncatedSVD(n_components=n_components, random_state=42)
-            X_reduced = self.svd_model.fit_transform(X_scaled)
+            n_components = min(50, X_scaled.shape[1] // 2)  # Reduce to 50 components or half the features
+            # TruncatedSVD's randomized solver: a few BLAS-3 passes over the dense matrix
+            self.svd_model = TruncatedSVD(
+                n_components=n_components, algorithm='randomized',
+                n_iter=4, n_oversamples=10, random_state=42
+            )
+            self.svd_model.fit(X_scaled)
             
             return {
                 "algorithm": "Singular Value Decomposition",
@@ -243,28 +316,60 @@ class RoommateMatchingML:
             logger.error(f"Error training SVD model: {e}")
             return {"status": "error", "message": str(e)}
     
-    async def _train_logistic_model(self, X: np.ndarray, y: np.ndarray) -> Dict[str, Any]:
+    def _split_training_rows(self, y: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
         """
-        Train Logistic Regression model for compatibility prediction
+        Split training row indices for validation, stratified by label
+        
+        Indices are sorted so row gathers walk X in memory order. Returns (None, None)
+        if the labels cannot be stratified (e.g. a class with a single user).
         """
         try:
-            # Split data for training and validation
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42, stratify=y
+            train_rows, test_rows = train_test_split(
+                np.arange(len(y)), test_size=0.2, random_state=42, stratify=y
             )
+            return np.sort(train_rows), np.sort(test_rows)
             
-            # Scale features
-            X_train_scaled = self.scaler.fit_transform(X_train)
-            X_test_scaled = self.scaler.transform(X_test)
+        except ValueError as e:
+            logger.error(f"Error splitting training data: {e}")
+            return None, None
+    
+    def _train_logistic_model(
+        self, X: np.ndarray, X_scaled: np.ndarray, y: np.ndarray,
+        train_rows: Optional[np.ndarray], test_rows: Optional[np.ndarray]
+    ) -> Dict[str, Any]:
+        """
+        Train Logistic Regression model for compatibility prediction
+        
+        Accuracy is measured on a validation model whose scaler is fit on the training
+        rows only, so it does not see test-set statistics. The served model is then fit
+        on every row scaled by the shared scaler that inference applies.
+        """
+        def fit(features: np.ndarray, labels: np.ndarray) -> LogisticRegression:
+            # liblinear converges in few iterations on small binary problems; lbfgs scales better
+            solver = 'liblinear' if len(labels) < LIBLINEAR_MAX_ROWS else 'lbfgs'
+            model = LogisticRegression(solver=solver, random_state=42, max_iter=200, tol=1e-3)
+            return model.fit(features, labels)
+        
+        try:
+            if train_rows is None:
+                raise ValueError("Training data could not be split for validation")
             
-            # Train Logistic Regression model
-            self.logistic_model = LogisticRegression(random_state=42, max_iter=1000)
-            self.logistic_model.fit(X_train_scaled, y_train)
+            # Gather the shared training and validation rows
+            X_train, X_test = X[train_rows], X[test_rows]
+            y_train, y_test = y[train_rows], y[test_rows]
+            
+            # Scale features
+            split_scaler = StandardScaler()
+            X_train_scaled = split_scaler.fit_transform(X_train)
+            X_test_scaled = split_scaler.transform(X_test)
             
             # Evaluate model
-            y_pred = self.logistic_model.predict(X_test_scaled)
+            y_pred = fit(X_train_scaled, y_train).predict(X_test_scaled)
             accuracy = accuracy_score(y_test, y_pred)
             
+            # Train the served model on the same standardization as matching uses
+            self.logistic_model = fit(X_scaled, y)
+            
             return {
                 "algorithm": "Logistic Regression",
                 "accuracy": round(accuracy, 4),
@@ -276,79 +381,100 @@ class RoommateMatchingML:
             logger.error(f"Error training Logistic Regression model: {e}")
             return {"status": "error", "message": str(e)}
     
+    def knn_neighbors(self, X_scaled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Query the KNN model with scaled feature rows
+        
+        Returns d**2 / 2 for the Euclidean distance d between L2-normalized rows, which
+        equals 1 - cosine similarity, and the training-row indices of each row's neighbours.
+        """
+        # For unit vectors, squared Euclidean distance is twice the cosine distance
+        distances, indices = self.knn_model.kneighbors(normalize(X_scaled))
+        return distances ** 2 / 2, indices
+    
     async def _save_models(self):
         """
         Save trained models to disk
+        
+        joblib writes the estimators' NumPy arrays as raw blocks, so load_models can
+        memory-map them instead of unpickling and copying every array. A manifest
+        naming the latest files is replaced atomically once all of them are written.
         """
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
-            if self.knn_model:
-                with open(f"{self.model_path}knn_model_{timestamp}.pkl", 'wb') as f:
-                    pickle.dump(self.knn_model, f)
+            artifacts = {
+                "knn": self.knn_model,
+                "svd": self.svd_model,
+                "logistic": self.logistic_model,
+                "scaler": self.scaler,
+                # The user id behind each training row so KNN indices can be resolved
+                "training_ids": self.training_user_ids
+            }
             
-            if self.svd_model:
-                with open(f"{self.model_path}svd_model_{timestamp}.pkl", 'wb') as f:
-                    pickle.dump(self.svd_model, f)
+            manifest = {
+                name: f"{name}_{timestamp}.joblib"
+                for name, artifact in artifacts.items() if artifact is not None
+            }
             
-            if self.logistic_model:
-                with open(f"{self.model_path}logistic_model_{timestamp}.pkl", 'wb') as f:
-                    pickle.dump(self.logistic_model, f)
+            # Write the files in worker threads so the event loop keeps serving requests
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(
+                    None, partial(joblib.dump, artifacts[name], f"{self.model_path}{file_name}", compress=0)
+                )
+                for name, file_name in manifest.items()
+            ))
             
-            # Save scaler
-            with open(f"{self.model_path}scaler_{timestamp}.pkl", 'wb') as f:
-                pickle.dump(self.scaler, f)
+            manifest_file = f"{self.model_path}{MODEL_MANIFEST}"
+            with open(f"{manifest_file}.tmp", 'w') as f:
+                json.dump(manifest, f)
+            os.replace(f"{manifest_file}.tmp", manifest_file)
             
             logger.info("Models saved successfully")
             
         except Exception as e:
             logger.error(f"Error saving models: {e}")
     
+    async def ensure_models_loaded(self) -> bool:
+        """
+        Load the saved models unless they are already in memory
+        
+        Concurrent callers share a single load instead of each reading the files.
+        """
+        async with self._load_lock:
+            if not self.models_trained:
+                await self.load_models()
+            return self.models_trained
+    
     async def load_models(self) -> bool:
         """
-        Load the most recent trained models from disk
+        Load the most recently saved models listed in the manifest
+        
+        Arrays are memory-mapped read-only rather than copied into the process.
         """
         try:
-            # Find the most recent model files
-            model_files = [f for f in os.listdir(self.model_path) if f.endswith('.pkl')]
-            
-            if not model_files:
+            manifest_file = f"{self.model_path}{MODEL_MANIFEST}"
+            if not os.path.exists(manifest_file):
                 logger.warning("No saved models found")
                 return False
             
-            # Get the most recent timestamp
-            timestamps = set()
-            for file in model_files:
-                if '_' in file:
-                    timestamp = file.split('_')[-1].replace('.pkl', '')
-                    timestamps.add(timestamp)
-            
-            if not timestamps:
-                return False
-            
-            latest_timestamp = max(timestamps)
-            
-            # Load models
-            knn_file = f"{self.model_path}knn_model_{latest_timestamp}.pkl"
-            svd_file = f"{self.model_path}svd_model_{latest_timestamp}.pkl"
-            logistic_file = f"{self.model_path}logistic_model_{latest_timestamp}.pkl"
-            scaler_file = f"{self.model_path}scaler_{latest_timestamp}.pkl"
-            
-            if os.path.exists(knn_file):
-                with open(knn_file, 'rb') as f:
-                    self.knn_model = pickle.load(f)
+            with open(manifest_file) as f:
+                manifest = json.load(f)
             
-            if os.path.exists(svd_file):
-                with open(svd_file, 'rb') as f:
-                    self.svd_model = pickle.load(f)
+            # Load models in worker threads so the event loop keeps serving requests
+            loop = asyncio.get_running_loop()
+            loaded = await asyncio.gather(*(
+                loop.run_in_executor(None, partial(joblib.load, f"{self.model_path}{file_name}", mmap_mode='r'))
+                for file_name in manifest.values()
+            ))
+            artifacts = dict(zip(manifest, loaded))
             
-            if os.path.exists(logistic_file):
-                with open(logistic_file, 'rb') as f:
-                    self.logistic_model = pickle.load(f)
-            
-            if os.path.exists(scaler_file):
-                with open(scaler_file, 'rb') as f:
-                    self.scaler = pickle.load(f)
+            self.knn_model = artifacts.get("knn")
+            self.svd_model = artifacts.get("svd")
+            self.logistic_model = artifacts.get("logistic")
+            self.scaler = artifacts.get("scaler", self.scaler)
+            self.training_user_ids = artifacts.get("training_ids")
             
             self.models_trained = True
             logger.info("Models loaded successfully")
@@ -358,6 +484,102 @@ class RoommateMatchingML:
             logger.error(f"Error loading models: {e}")
             return False
     
+    async def ensure_embedding_matrix(self, db_connection) -> np.ndarray:
+        """
+        Return the cached embedding matrix, building it from the database if needed
+        """
+        async with self._embedding_lock:
+            if self.embedding_matrix is None:
+                await self.refresh_embedding_matrix(db_connection)
+            return self.embedding_matrix
+    
+    async def refresh_embedding_matrix(self, db_connection) -> int:
+        """
+        Rebuild the (N, d) float32 embedding matrix and its id -> row index
+        """
+        while True:
+            version = self._embedding_version
+            rows = await db_connection.fetch(EMBEDDING_USERS_SQL)
+            
+            # Stack and factorize in a worker thread so the event loop keeps serving requests
+            cache = await asyncio.get_running_loop().run_in_executor(
+                None, self._build_embedding_cache, rows
+            )
+            
+            # Retry if a write invalidated the cache while we were reading
+            if version == self._embedding_version:
+                break
+        
+        self._set_embedding_matrix(cache)
+        logger.info(f"Embedding matrix cached for {len(rows)} users")
+        return len(rows)
+    
+    def invalidate_embedding_matrix(self):
+        """
+        Drop the cached embedding matrix after users or their embeddings change
+        """
+        self._embedding_version += 1
+        self.embedding_matrix = None
+        self.unit_embedding_matrix = None
+        self.feature_extras = None
+        self.user_ids = None
+        self.id_to_row = {}
+        self.category_codes = {}
+        self.category_values = {}
+    
+    def _build_embedding_cache(self, users: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build the embedding matrix, feature extras and categorical code arrays from user rows
+        
+        Each categorical column is factorized into small integer codes (-1 for NULL)
+        so rule-based scoring can compare every cached user with array operations.
+        The non-embedding model features (age + encoded preferences) are cached too,
+        so matching never needs to re-read candidate rows from the database.
+        Pure CPU work with no shared state, so it is safe to run in a worker thread.
+        """
+        user_ids = [user['id'] for user in users]
+        embeddings = [user['embedding_vector'] for user in users]
+        
+        category_codes = {}
+        category_values = {}
+        for column in CATEGORICAL_COLUMNS:
+            codes, values = pd.factorize(pd.Series([user[column] for user in users], dtype=object))
+            category_codes[column] = codes.astype(np.int8 if len(values) < 128 else np.int32)
+            category_values[column] = list(values)
+        
+        if embeddings:
+            matrix = np.asarray(embeddings, dtype=np.float32)
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        
+        # Same layout as the extra columns of _prepare_training_data's features
+        feature_extras = self._encode_feature_extras(pd.DataFrame({
+            column: pd.Series([user[column] for user in users], dtype=object)
+            for column in ('age', *(column for column, _ in FEATURE_ENCODINGS))
+        }))
+        
+        return {
+            "user_ids": np.asarray(user_ids, dtype=np.int64),
+            "id_to_row": {user_id: row for row, user_id in enumerate(user_ids)},
+            "category_codes": category_codes,
+            "category_values": category_values,
+            "embedding_matrix": matrix,
+            "unit_embedding_matrix": normalize_embeddings(matrix),
+            "feature_extras": feature_extras
+        }
+    
+    def _set_embedding_matrix(self, cache: Dict[str, Any]):
+        """
+        Install a cache built by `_build_embedding_cache`
+        """
+        self.user_ids = cache["user_ids"]
+        self.id_to_row = cache["id_to_row"]
+        self.category_codes = cache["category_codes"]
+        self.category_values = cache["category_values"]
+        self.embedding_matrix = cache["embedding_matrix"]
+        self.unit_embedding_matrix = cache["unit_embedding_matrix"]
+        self.feature_extras = cache["feature_extras"]
+    
     def get_model_status(self) -> Dict[str, Any]:
         """
         Get the current status of all models
@@ -1,11 +1,44 @@
 import asyncio
+import bisect
+import functools
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import re
+from collections import OrderedDict
+from typing import List, Dict, Any, Mapping, Optional, Sequence, Tuple
 import numpy as np
+import pandas as pd
 from datetime import datetime
+from scipy.optimize import linear_sum_assignment
 
 logger = logging.getLogger(__name__)
 
+# First number in a free-form budget range
+BUDGET_NUMBER_RE = re.compile(r'\d+')
+
+# Users sharing a room need a compatibility score of 0.6, i.e. 12 points of 0.05
+COMPATIBILITY_THRESHOLD_POINTS = 12
+
+# Ordinal levels for compatibility; unknown answers count as 2 (moderate)
+CLEANLINESS_LEVELS = {
+    'very_clean': 4,
+    'clean': 3,
+    'moderate': 2,
+    'relaxed': 1,
+    'very_relaxed': 0
+}
+
+NOISE_LEVELS = {
+    'very_quiet': 0,
+    'quiet': 1,
+    'moderate': 2,
+    'tolerant': 3,
+    'very_tolerant': 4
+}
+
+# Recent allocation results, so retried or repeated requests skip the scoring work
+ALLOCATION_CACHE_SIZE = 64
+
 class RoomAllocationService:
     """
     Service for intelligent room allocation and assignment
@@ -18,11 +51,12 @@ class RoomAllocationService:
             'location_first': self._allocate_by_location,
             'balanced': self._allocate_balanced
         }
+        self._allocation_cache: "OrderedDict[bytes, List[Dict[str, Any]]]" = OrderedDict()
     
     async def allocate_rooms(
         self, 
-        users: List[Dict[str, Any]], 
-        rooms: List[Dict[str, Any]], 
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]], 
         strategy: str = 'balanced'
     ) -> Dict[str, Any]:
         """
@@ -62,8 +96,20 @@ class RoomAllocationService:
                     "allocations": []
                 }
             
-            # Perform allocation
-            allocations = await allocation_func(users, rooms)
+            # Reuse the result of an identical earlier request
+            key = self._allocation_key(users, rooms, strategy)
+            cached = self._allocation_cache.get(key)
+            if cached is not None:
+                self._allocation_cache.move_to_end(key)
+            else:
+                # Perform allocation; strategies are CPU-bound, so keep them off the event loop
+                cached = await asyncio.get_running_loop().run_in_executor(None, allocation_func, users, rooms)
+                self._allocation_cache[key] = cached
+                while len(self._allocation_cache) > ALLOCATION_CACHE_SIZE:
+                    self._allocation_cache.popitem(last=False)
+            
+            # Callers get their own copies so the cached entries stay untouched
+            allocations = [dict(allocation) for allocation in cached]
             
             return {
                 "success": True,
@@ -83,10 +129,26 @@ class RoomAllocationService:
                 "allocations": []
             }
     
-    async def _allocate_by_compatibility(
+    def _allocation_key(
+        self, 
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]], 
+        strategy: str
+    ) -> bytes:
+        """
+        Hash the full allocation input into a cache key
+        """
+        content = repr((
+            strategy,
+            [sorted(dict(user).items()) for user in users],
+            [sorted(dict(room).items()) for room in rooms]
+        ))
+        return hashlib.blake2b(content.encode(), digest_size=16).digest()
+    
+    def _allocate_by_compatibility(
         self, 
-        users: List[Dict[str, Any]], 
-        rooms: List[Dict[str, Any]]
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
         Allocate rooms prioritizing user compatibility
@@ -94,21 +156,17 @@ class RoomAllocationService:
         allocations = []
         
         # Group users by compatibility
-        user_groups = await self._group_users_by_compatibility(users)
+        user_groups = self._group_users_by_compatibility(users)
         
-        # Sort rooms by capacity (larger rooms first for groups)
-        sorted_rooms = sorted(rooms, key=lambda r: r['capacity'], reverse=True)
+        # Sort rooms by capacity (ascending) so the smallest room that fits is found by bisection
+        sorted_rooms = sorted(rooms, key=lambda r: r['capacity'])
+        capacities = [room['capacity'] for room in sorted_rooms]
         
-        # Allocate groups to rooms
-        room_index = 0
-        for group in user_groups:
-            if room_index >= len(sorted_rooms):
-                break
-                
-            room = sorted_rooms[room_index]
+        # First-fit decreasing: largest groups first, each into the smallest room that fits
+        for group in sorted(user_groups, key=len, reverse=True):
+            room = self._pop_smallest_room(sorted_rooms, capacities, len(group))
             
-            # Check if room can accommodate the group
-            if room['capacity'] >= len(group):
+            if room is not None:
                 # Assign all users in group to this room
                 for user in group:
                     allocations.append({
@@ -120,13 +178,11 @@ class RoomAllocationService:
                         "group_size": len(group),
                         "reason": "compatibility_group"
                     })
-                
-                room_index += 1
             else:
-                # Room too small for group, try to split
+                # No room fits the whole group, so split it
                 for user in group:
-                    if room_index < len(sorted_rooms):
-                        room = sorted_rooms[room_index]
+                    room = self._pop_smallest_room(sorted_rooms, capacities, 1)
+                    if room is not None:
                         allocations.append({
                             "user_id": user['id'],
                             "user_name": user['name'],
@@ -136,7 +192,6 @@ class RoomAllocationService:
                             "group_size": 1,
                             "reason": "compatibility_split"
                         })
-                        room_index += 1
                     else:
                         allocations.append({
                             "user_id": user['id'],
@@ -148,38 +203,27 @@ class RoomAllocationService:
                             "reason": "no_rooms_available"
                         })
         
-        # Handle remaining users
-        for user in users:
-            if not any(a['user_id'] == user['id'] for a in allocations):
-                if room_index < len(sorted_rooms):
-                    room = sorted_rooms[room_index]
-                    allocations.append({
-                        "user_id": user['id'],
-                        "user_name": user['name'],
-                        "room_id": room['id'],
-                        "room_number": room['room_number'],
-                        "assigned": True,
-                        "group_size": 1,
-                        "reason": "remaining_user"
-                    })
-                    room_index += 1
-                else:
-                    allocations.append({
-                        "user_id": user['id'],
-                        "user_name": user['name'],
-                        "room_id": None,
-                        "room_number": None,
-                        "assigned": False,
-                        "group_size": 1,
-                        "reason": "no_rooms_available"
-                    })
-        
         return allocations
     
-    async def _allocate_by_budget(
+    def _pop_smallest_room(
         self, 
-        users: List[Dict[str, Any]], 
-        rooms: List[Dict[str, Any]]
+        sorted_rooms: List[Mapping[str, Any]], 
+        capacities: List[int], 
+        size: int
+    ) -> Optional[Mapping[str, Any]]:
+        """
+        Remove and return the smallest room with capacity for size users, if any
+        """
+        index = bisect.bisect_left(capacities, size)
+        if index == len(sorted_rooms):
+            return None
+        capacities.pop(index)
+        return sorted_rooms.pop(index)
+    
+    def _allocate_by_budget(
+        self, 
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
         Allocate rooms prioritizing budget constraints
@@ -187,40 +231,37 @@ class RoomAllocationService:
         allocations = []
         
         # Sort users by budget (ascending) and rooms by price (ascending)
-        sorted_users = sorted(users, key=lambda u: self._extract_budget_value(u.get('budget_range', '')))
-        sorted_rooms = sorted(rooms, key=lambda r: r.get('monthly_rent', 0))
-        
-        user_index = 0
-        room_index = 0
-        
-        while user_index < len(sorted_users) and room_index < len(sorted_rooms):
-            user = sorted_users[user_index]
-            room = sorted_rooms[room_index]
-            
-            user_budget = self._extract_budget_value(user.get('budget_range', ''))
-            room_price = room.get('monthly_rent', 0)
-            
-            if room_price <= user_budget:
-                allocations.append({
-                    "user_id": user['id'],
-                    "user_name": user['name'],
-                    "room_id": room['id'],
-                    "room_number": room['room_number'],
-                    "assigned": True,
-                    "budget_match": True,
-                    "user_budget": user_budget,
-                    "room_price": room_price,
-                    "reason": "budget_match"
-                })
-                user_index += 1
-                room_index += 1
-            else:
-                # User can't afford this room, try next room
-                room_index += 1
+        user_budgets = self._user_budgets(users)
+        room_prices = self._room_prices(rooms)
+        user_order = np.argsort(user_budgets, kind='stable')
+        room_order = np.argsort(room_prices, kind='stable')
+        
+        # The i-th cheapest room goes to the i-th lowest budget until the first room
+        # that budget can't afford; every later room costs more, so matching stops there
+        paired = min(len(users), len(rooms))
+        unaffordable = np.flatnonzero(
+            room_prices[room_order[:paired]] > user_budgets[user_order[:paired]]
+        )
+        matched = int(unaffordable[0]) if unaffordable.size else paired
+        
+        for i, j in zip(user_order[:matched].tolist(), room_order[:matched].tolist()):
+            user = users[i]
+            room = rooms[j]
+            allocations.append({
+                "user_id": user['id'],
+                "user_name": user['name'],
+                "room_id": room['id'],
+                "room_number": room['room_number'],
+                "assigned": True,
+                "budget_match": True,
+                "user_budget": float(user_budgets[i]),
+                "room_price": room.get('monthly_rent', 0),
+                "reason": "budget_match"
+            })
         
         # Handle remaining users
-        for i in range(user_index, len(sorted_users)):
-            user = sorted_users[i]
+        for i in user_order[matched:].tolist():
+            user = users[i]
             allocations.append({
                 "user_id": user['id'],
                 "user_name": user['name'],
@@ -232,10 +273,10 @@ class RoomAllocationService:
         
         return allocations
     
-    async def _allocate_by_location(
+    def _allocate_by_location(
         self, 
-        users: List[Dict[str, Any]], 
-        rooms: List[Dict[str, Any]]
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
         Allocate rooms prioritizing location preferences
@@ -284,54 +325,42 @@ class RoomAllocationService:
         
         return allocations
     
-    async def _allocate_balanced(
+    def _allocate_balanced(
         self, 
-        users: List[Dict[str, Any]], 
-        rooms: List[Dict[str, Any]]
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]]
     ) -> List[Dict[str, Any]]:
         """
         Balanced allocation considering multiple factors
+        
+        Users and rooms are paired one-to-one so that the total user-room score is
+        as high as possible (Hungarian algorithm), rather than greedily by best pair.
         """
         allocations = []
         
         # Calculate scores for each user-room combination
-        user_room_scores = []
-        
-        for user in users:
-            for room in rooms:
-                score = await self._calculate_user_room_score(user, room)
-                user_room_scores.append({
-                    "user": user,
-                    "room": room,
-                    "score": score
-                })
+        scores = self._calculate_user_room_scores(users, rooms)
         
-        # Sort by score (descending)
-        user_room_scores.sort(key=lambda x: x['score'], reverse=True)
+        # Optimal assignment; with more users than rooms the rest stay unassigned
+        user_rows, room_columns = linear_sum_assignment(scores, maximize=True)
         
-        # Greedy allocation
         assigned_users = set()
-        assigned_rooms = set()
         
-        for user_room in user_room_scores:
-            user = user_room['user']
-            room = user_room['room']
+        for i, j in zip(user_rows.tolist(), room_columns.tolist()):
+            user = users[i]
+            room = rooms[j]
             
-            if (user['id'] not in assigned_users and 
-                room['id'] not in assigned_rooms):
-                
-                allocations.append({
-                    "user_id": user['id'],
-                    "user_name": user['name'],
-                    "room_id": room['id'],
-                    "room_number": room['room_number'],
-                    "assigned": True,
-                    "score": user_room['score'],
-                    "reason": "balanced_allocation"
-                })
-                
-                assigned_users.add(user['id'])
-                assigned_rooms.add(room['id'])
+            allocations.append({
+                "user_id": user['id'],
+                "user_name": user['name'],
+                "room_id": room['id'],
+                "room_number": room['room_number'],
+                "assigned": True,
+                "score": float(scores[i, j]),
+                "reason": "balanced_allocation"
+            })
+            
+            assigned_users.add(user['id'])
         
         # Handle unassigned users
         for user in users:
@@ -347,106 +376,161 @@ class RoomAllocationService:
         
         return allocations
     
-    async def _group_users_by_compatibility(self, users: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    def _group_users_by_compatibility(self, users: Sequence[Mapping[str, Any]]) -> List[List[Mapping[str, Any]]]:
         """
         Group users by compatibility scores
         """
         if len(users) <= 1:
             return [users] if users else []
         
+        # Compatibility of every pair, computed once up front
+        compatible = self._compatibility_matrix(users)
+        
         groups = []
-        used_users = set()
+        used = np.zeros(len(users), dtype=bool)
         
-        for i, user1 in enumerate(users):
-            if user1['id'] in used_users:
+        for i in range(len(users)):
+            if used[i]:
                 continue
-                
-            group = [user1]
-            used_users.add(user1['id'])
+            used[i] = True
             
-            for j, user2 in enumerate(users):
-                if (j != i and user2['id'] not in used_users and 
-                    await self._are_users_compatible(user1, user2)):
-                    group.append(user2)
-                    used_users.add(user2['id'])
-                    
-                    # Limit group size to 4 for practical room sharing
-                    if len(group) >= 4:
-                        break
+            # Every earlier user is already grouped and compatibility is symmetric, so
+            # only later users are candidates; limit group size to 4 for practical room sharing
+            members = i + 1 + np.flatnonzero(compatible[i, i + 1:] & ~used[i + 1:])[:3]
+            used[members] = True
             
-            groups.append(group)
+            groups.append([users[i], *(users[j] for j in members)])
         
         return groups
     
-    async def _are_users_compatible(self, user1: Dict[str, Any], user2: Dict[str, Any]) -> bool:
+    def _compatibility_matrix(self, users: Sequence[Mapping[str, Any]]) -> np.ndarray:
         """
-        Check if two users are compatible for room sharing
+        Check which pairs of users are compatible for room sharing
+        
+        Returns a symmetric (N, N) boolean matrix. Preferences are read once into
+        code arrays and every pair is scored with broadcasting.
         """
-        compatibility_score = 0.0
+        def factorize(column: str) -> Tuple[np.ndarray, np.ndarray]:
+            # Equal values (including two NULLs) share a code
+            values = pd.Series([user.get(column) for user in users], dtype=object)
+            return pd.factorize(values, use_na_sentinel=False)
+        
+        def codes(column: str) -> np.ndarray:
+            return factorize(column)[0]
+        
+        def levels(column: str, mapping: Mapping[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+            # Codes plus ordinal levels, looked up once per distinct value
+            column_codes, uniques = factorize(column)
+            lookup = np.array([mapping.get(value, 2) for value in uniques], dtype=np.int8)
+            return column_codes, lookup[column_codes]
+        
+        def same(column_codes: np.ndarray) -> np.ndarray:
+            return column_codes[:, None] == column_codes[None, :]
+        
+        def near(numbers: np.ndarray) -> np.ndarray:
+            return np.abs(numbers[:, None] - numbers[None, :]) <= 1
+        
+        # Scores are kept as int8 points of 0.05 each, which sum exactly where
+        # float weights would not and take an eighth of the memory
+        compatibility_points = np.zeros((len(users), len(users)), dtype=np.int8)
         
         # Sleep schedule compatibility
-        if user1.get('sleep_schedule') == user2.get('sleep_schedule'):
-            compatibility_score += 0.3
-        elif user1.get('sleep_schedule') == 'flexible' or user2.get('sleep_schedule') == 'flexible':
-            compatibility_score += 0.15
+        flexible = np.array([user.get('sleep_schedule') == 'flexible' for user in users])
+        compatibility_points += np.where(
+            same(codes('sleep_schedule')), np.int8(6),
+            np.where(flexible[:, None] | flexible[None, :], np.int8(3), np.int8(0))
+        )
         
         # Cleanliness compatibility
-        if user1.get('cleanliness_level') == user2.get('cleanliness_level'):
-            compatibility_score += 0.3
-        elif abs(self._cleanliness_to_number(user1.get('cleanliness_level')) - 
-                self._cleanliness_to_number(user2.get('cleanliness_level'))) <= 1:
-            compatibility_score += 0.15
+        cleanliness_codes, cleanliness = levels('cleanliness_level', CLEANLINESS_LEVELS)
+        compatibility_points += np.where(
+            same(cleanliness_codes), np.int8(6),
+            np.where(near(cleanliness), np.int8(3), np.int8(0))
+        )
         
         # Noise tolerance compatibility
-        if user1.get('noise_tolerance') == user2.get('noise_tolerance'):
-            compatibility_score += 0.2
-        elif abs(self._noise_to_number(user1.get('noise_tolerance')) - 
-                self._noise_to_number(user2.get('noise_tolerance'))) <= 1:
-            compatibility_score += 0.1
+        noise_codes, noise = levels('noise_tolerance', NOISE_LEVELS)
+        compatibility_points += np.where(
+            same(noise_codes), np.int8(4),
+            np.where(near(noise), np.int8(2), np.int8(0))
+        )
         
         # Pet preference compatibility
-        if user1.get('pet_preference') == user2.get('pet_preference'):
-            compatibility_score += 0.2
+        compatibility_points += np.where(same(codes('pet_preference')), np.int8(4), np.int8(0))
         
-        return compatibility_score >= 0.6  # Threshold for compatibility
+        return compatibility_points >= COMPATIBILITY_THRESHOLD_POINTS
     
-    async def _calculate_user_room_score(self, user: Dict[str, Any], room: Dict[str, Any]) -> float:
-        """
-        Calculate compatibility score between user and room
+    def _calculate_user_room_scores(
+        self, 
+        users: Sequence[Mapping[str, Any]], 
+        rooms: Sequence[Mapping[str, Any]]
+    ) -> np.ndarray:
         """
-        score = 0.0
+        Calculate the compatibility score of every user-room combination
         
+        Each user and room field is read once into an array, and the (users, rooms)
+        score matrix is built with broadcasting instead of scoring pair by pair.
+        """
         # Budget compatibility
-        user_budget = self._extract_budget_value(user.get('budget_range', ''))
-        room_price = room.get('monthly_rent', 0)
-        
-        if room_price <= user_budget:
-            score += 0.4
-        elif room_price <= user_budget * 1.2:  # 20% tolerance
-            score += 0.2
-        
-        # Location preference
-        user_location = user.get('location_preference', '').lower()
-        room_location = str(room.get('floor_number', '')).lower()
-        
-        if user_location in room_location or room_location in user_location:
-            score += 0.3
-        elif user_location == 'any':
-            score += 0.15
+        user_budgets = self._user_budgets(users)
+        room_prices = self._room_prices(rooms)
+        
+        within_budget = room_prices[None, :] <= user_budgets[:, None]
+        within_tolerance = room_prices[None, :] <= user_budgets[:, None] * 1.2  # 20% tolerance
+        scores = np.where(within_budget, 0.4, np.where(within_tolerance, 0.2, 0.0))
+        
+        # Location preference, compared once per distinct user and room location
+        user_locations, user_codes = np.unique(
+            [(user.get('location_preference') or '').lower() for user in users], return_inverse=True
+        )
+        room_locations, room_codes = np.unique(
+            [str(room.get('floor_number', '')).lower() for room in rooms], return_inverse=True
+        )
+        location_scores = np.array([
+            [
+                0.3 if user_location in room_location or room_location in user_location
+                else 0.15 if user_location == 'any' else 0.0
+                for room_location in room_locations
+            ]
+            for user_location in user_locations
+        ]).reshape(len(user_locations), len(room_locations))
+        scores += location_scores[user_codes.reshape(-1)[:, None], room_codes.reshape(-1)[None, :]]
         
         # Room amenities (basic check)
-        if room.get('amenities'):
-            score += 0.1
+        scores += np.array([0.1 if room.get('amenities') else 0.0 for room in rooms])[None, :]
         
         # Room type preference (assuming shared rooms are preferred for social users)
-        if user.get('social_preference') in ['social', 'very_social'] and room.get('room_type') == 'shared':
-            score += 0.2
+        social_users = np.array([user.get('social_preference') in ['social', 'very_social'] for user in users])
+        shared_rooms = np.array([room.get('room_type') == 'shared' for room in rooms])
+        scores += np.where(social_users[:, None] & shared_rooms[None, :], 0.2, 0.0)
         
-        return score
+        return scores
     
-    def _extract_budget_value(self, budget_range: str) -> float:
+    def _user_budgets(self, users: Sequence[Mapping[str, Any]]) -> np.ndarray:
+        """
+        Parse every user's budget range into one contiguous float array
+        """
+        return np.fromiter(
+            (self._extract_budget_value(user.get('budget_range') or '') for user in users),
+            dtype=np.float64, count=len(users)
+        )
+    
+    def _room_prices(self, rooms: Sequence[Mapping[str, Any]]) -> np.ndarray:
+        """
+        Read every room's monthly rent into one contiguous float array
+        """
+        return np.fromiter(
+            (float(room.get('monthly_rent') or 0) for room in rooms),
+            dtype=np.float64, count=len(rooms)
+        )
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _extract_budget_value(budget_range: str) -> float:
         """
         Extract numerical budget value from budget range string
+        
+        Budget ranges come from a handful of survey answers, so results are memoized.
         """
         try:
             # Handle different budget range formats
@@ -464,35 +548,12 @@ class RoomAllocationService:
                 return 2000.0
             else:
                 # Try to extract any number
-                import re
-                numbers = re.findall(r'\d+', budget_range)
-                if numbers:
-                    return float(numbers[0])
+                number = BUDGET_NUMBER_RE.search(budget_range)
+                if number:
+                    return float(number.group())
                 return 1000.0  # Default
         except:
             return 1000.0  # Default
-    
-    def _cleanliness_to_number(self, level: str) -> int:
-        """Convert cleanliness level to number"""
-        mapping = {
-            'very_clean': 4,
-            'clean': 3,
-            'moderate': 2,
-            'relaxed': 1,
-            'very_relaxed': 0
-        }
-        return mapping.get(level, 2)
-    
-    def _noise_to_number(self, level: str) -> int:
-        """Convert noise tolerance to number"""
-        mapping = {
-            'very_quiet': 0,
-            'quiet': 1,
-            'moderate': 2,
-            'tolerant': 3,
-            'very_tolerant': 4
-        }
-        return mapping.get(level, 2)
 
 # Global room allocation service instance
 room_allocation_service = RoomAllocationService() 
\ No newline at end of file
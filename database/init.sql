@@ -9,6 +9,7 @@
 
 -- Create extensions
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+CREATE EXTENSION IF NOT EXISTS vector;
 
 -- Create users table
 CREATE TABLE IF NOT EXISTS users (
@@ -27,7 +28,8 @@ CREATE TABLE IF NOT EXISTS users (
     smoking_preference VARCHAR(20),
     budget_range VARCHAR(50),
     location_preference VARCHAR(100),
-    embedding_vector REAL[],
+    embedding_vector halfvec(384),
+    text_hash BYTEA,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -69,11 +71,20 @@ CREATE TABLE IF NOT EXISTS compatibility_scores (
     UNIQUE(user1_id, user2_id)
 );
 
+-- Embeddings keyed by SHA-256 of the embedded text
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    text_hash BYTEA PRIMARY KEY,
+    embedding halfvec(384) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_users_embedding ON users USING GIN (embedding_vector);
-CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
-CREATE INDEX IF NOT EXISTS idx_rooms_occupied ON rooms(is_occupied);
-CREATE INDEX IF NOT EXISTS idx_compatibility_scores ON compatibility_scores(user1_id, user2_id);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_users_embedding_hnsw ON users USING hnsw (embedding_vector halfvec_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX IF NOT EXISTS idx_users_with_embedding ON users(id) WHERE embedding_vector IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_rooms_available ON rooms(id) WHERE is_occupied = FALSE;
+CREATE INDEX IF NOT EXISTS idx_room_assignments_active_user ON room_assignments(user_id) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_room_assignments_active_room ON room_assignments(room_id) WHERE status = 'active';
 
 -- Insert sample rooms for testing
 INSERT INTO rooms (room_number, floor_number, room_type, capacity, monthly_rent, amenities) VALUES
@@ -10,105 +10,147 @@ import asyncio
 import asyncpg
 import os
 import sys
+from decimal import Decimal
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Database schema
-SCHEMA_SQL = """
--- Create extensions
-CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
-
--- Create users table
-CREATE TABLE IF NOT EXISTS users (
-    id SERIAL PRIMARY KEY,
-    name VARCHAR(100) NOT NULL,
-    age INTEGER CHECK (age >= 18 AND age <= 100),
-    gender VARCHAR(20),
-    occupation VARCHAR(100),
-    sleep_schedule VARCHAR(50),
-    cleanliness_level VARCHAR(50),
-    noise_tolerance VARCHAR(50),
-    social_preference VARCHAR(50),
-    hobbies TEXT,
-    dietary_restrictions TEXT,
-    pet_preference VARCHAR(20),
-    smoking_preference VARCHAR(20),
-    budget_range VARCHAR(50),
-    location_preference VARCHAR(100),
-    embedding_vector REAL[],
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
--- Create rooms table
-CREATE TABLE IF NOT EXISTS rooms (
-    id SERIAL PRIMARY KEY,
-    room_number VARCHAR(20) UNIQUE NOT NULL,
-    floor_number INTEGER,
-    room_type VARCHAR(50),
-    capacity INTEGER DEFAULT 2,
-    is_occupied BOOLEAN DEFAULT FALSE,
-    preferences TEXT,
-    monthly_rent DECIMAL(10,2),
-    amenities TEXT[],
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
--- Create room assignments table
-CREATE TABLE IF NOT EXISTS room_assignments (
-    id SERIAL PRIMARY KEY,
-    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    room_id INTEGER REFERENCES rooms(id) ON DELETE CASCADE,
-    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    status VARCHAR(20) DEFAULT 'active',
-    UNIQUE(user_id, room_id)
-);
-
--- Create compatibility scores table
-CREATE TABLE IF NOT EXISTS compatibility_scores (
-    id SERIAL PRIMARY KEY,
-    user1_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    user2_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    knn_score DECIMAL(5,4),
-    svd_score DECIMAL(5,4),
-    final_score DECIMAL(5,4),
-    explanation TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(user1_id, user2_id)
-);
-
--- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_users_embedding ON users USING GIN (embedding_vector);
-CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at);
-CREATE INDEX IF NOT EXISTS idx_rooms_occupied ON rooms(is_occupied);
-CREATE INDEX IF NOT EXISTS idx_compatibility_scores ON compatibility_scores(user1_id, user2_id);
-
--- Insert sample rooms for testing
-INSERT INTO rooms (room_number, floor_number, room_type, capacity, monthly_rent, amenities) VALUES
-('101', 1, 'shared', 2, 800.00, ARRAY['WiFi', 'Kitchen', 'Bathroom']),
-('102', 1, 'shared', 2, 850.00, ARRAY['WiFi', 'Kitchen', 'Bathroom', 'Balcony']),
-('201', 2, 'shared', 2, 900.00, ARRAY['WiFi', 'Kitchen', 'Bathroom', 'Study Desk']),
-('202', 2, 'shared', 2, 950.00, ARRAY['WiFi', 'Kitchen', 'Bathroom', 'Balcony', 'Study Desk']),
-('301', 3, 'shared', 2, 1000.00, ARRAY['WiFi', 'Kitchen', 'Bathroom', 'Study Desk', 'Air Conditioning'])
-ON CONFLICT (room_number) DO NOTHING;
-
--- Create a function to update the updated_at timestamp
-CREATE OR REPLACE FUNCTION update_updated_at_column()
-RETURNS TRIGGER AS $$
-BEGIN
-    NEW.updated_at = CURRENT_TIMESTAMP;
-    RETURN NEW;
-END;
-$$ language 'plpgsql';
+# Database schema, one statement per entry so each runs on its own
+SCHEMA_STATEMENTS = [
+    # Create extensions
+    'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"',
+    "CREATE EXTENSION IF NOT EXISTS vector",
+    
+    # Create users table
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        age INTEGER CHECK (age >= 18 AND age <= 100),
+        gender VARCHAR(20),
+        occupation VARCHAR(100),
+        sleep_schedule VARCHAR(50),
+        cleanliness_level VARCHAR(50),
+        noise_tolerance VARCHAR(50),
+        social_preference VARCHAR(50),
+        hobbies TEXT,
+        dietary_restrictions TEXT,
+        pet_preference VARCHAR(20),
+        smoking_preference VARCHAR(20),
+        budget_range VARCHAR(50),
+        location_preference VARCHAR(100),
+        embedding_vector halfvec(384),
+        text_hash BYTEA,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    
+    # Create rooms table
+    """
+    CREATE TABLE IF NOT EXISTS rooms (
+        id SERIAL PRIMARY KEY,
+        room_number VARCHAR(20) UNIQUE NOT NULL,
+        floor_number INTEGER,
+        room_type VARCHAR(50),
+        capacity INTEGER DEFAULT 2,
+        is_occupied BOOLEAN DEFAULT FALSE,
+        preferences TEXT,
+        monthly_rent DECIMAL(10,2),
+        amenities TEXT[],
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    
+    # Create room assignments table
+    """
+    CREATE TABLE IF NOT EXISTS room_assignments (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        room_id INTEGER REFERENCES rooms(id) ON DELETE CASCADE,
+        assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status VARCHAR(20) DEFAULT 'active',
+        UNIQUE(user_id, room_id)
+    )
+    """,
+    
+    # Create compatibility scores table
+    """
+    CREATE TABLE IF NOT EXISTS compatibility_scores (
+        id SERIAL PRIMARY KEY,
+        user1_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        user2_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        knn_score DECIMAL(5,4),
+        svd_score DECIMAL(5,4),
+        final_score DECIMAL(5,4),
+        explanation TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user1_id, user2_id)
+    )
+    """,
+    
+    # Embeddings keyed by SHA-256 of the embedded text
+    """
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        text_hash BYTEA PRIMARY KEY,
+        embedding halfvec(384) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    
+    # Create indexes for better performance
+    "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_users_embedding_hnsw ON users USING hnsw (embedding_vector halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)",
+    "CREATE INDEX IF NOT EXISTS idx_users_with_embedding ON users(id) WHERE embedding_vector IS NOT NULL",
+    "DROP INDEX IF EXISTS idx_rooms_occupied",
+    "CREATE INDEX IF NOT EXISTS idx_rooms_available ON rooms(id) WHERE is_occupied = FALSE",
+    "CREATE INDEX IF NOT EXISTS idx_room_assignments_active_user ON room_assignments(user_id) WHERE status = 'active'",
+    "CREATE INDEX IF NOT EXISTS idx_room_assignments_active_room ON room_assignments(room_id) WHERE status = 'active'",
+    
+    # Create a function to update the updated_at timestamp
+    """
+    CREATE OR REPLACE FUNCTION update_updated_at_column()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.updated_at = CURRENT_TIMESTAMP;
+        RETURN NEW;
+    END;
+    $$ language 'plpgsql'
+    """,
+    
+    # Create trigger to automatically update updated_at (recreated so reruns succeed)
+    "DROP TRIGGER IF EXISTS update_users_updated_at ON users",
+    """
+    CREATE TRIGGER update_users_updated_at 
+        BEFORE UPDATE ON users 
+        FOR EACH ROW 
+        EXECUTE FUNCTION update_updated_at_column()
+    """
+]
+
+# Sample rooms for testing, bulk-loaded with binary COPY into a staging table
+# and merged so existing room numbers are left alone
+ROOM_COLUMNS = ['room_number', 'floor_number', 'room_type', 'capacity', 'monthly_rent', 'amenities']
+
+CREATE_ROOMS_STAGING_SQL = f"""
+    CREATE TEMP TABLE rooms_staging ON COMMIT DROP AS
+    SELECT {', '.join(ROOM_COLUMNS)} FROM rooms WITH NO DATA
+"""
 
--- Create trigger to automatically update updated_at
-CREATE TRIGGER update_users_updated_at 
-    BEFORE UPDATE ON users 
-    FOR EACH ROW 
-    EXECUTE FUNCTION update_updated_at_column();
+MERGE_ROOMS_STAGING_SQL = f"""
+    INSERT INTO rooms ({', '.join(ROOM_COLUMNS)})
+    SELECT {', '.join(ROOM_COLUMNS)} FROM rooms_staging
+    ON CONFLICT (room_number) DO NOTHING
 """
 
+SAMPLE_ROOMS = [
+    ('101', 1, 'shared', 2, Decimal('800.00'), ['WiFi', 'Kitchen', 'Bathroom']),
+    ('102', 1, 'shared', 2, Decimal('850.00'), ['WiFi', 'Kitchen', 'Bathroom', 'Balcony']),
+    ('201', 2, 'shared', 2, Decimal('900.00'), ['WiFi', 'Kitchen', 'Bathroom', 'Study Desk']),
+    ('202', 2, 'shared', 2, Decimal('950.00'), ['WiFi', 'Kitchen', 'Bathroom', 'Balcony', 'Study Desk']),
+    ('301', 3, 'shared', 2, Decimal('1000.00'), ['WiFi', 'Kitchen', 'Bathroom', 'Study Desk', 'Air Conditioning'])
+]
+
 async def init_neon_database():
     """Initialize Neon database with schema"""
     
@@ -129,9 +171,16 @@ async def init_neon_database():
         
         print("✅ Connected to Neon database successfully!")
         
-        # Execute schema
+        # Execute schema and sample data atomically
         print("📋 Creating database schema...")
-        await conn.execute(SCHEMA_SQL)
+        async with conn.transaction():
+            for statement in SCHEMA_STATEMENTS:
+                await conn.execute(statement)
+            await conn.execute(CREATE_ROOMS_STAGING_SQL)
+            await conn.copy_records_to_table('rooms_staging', records=SAMPLE_ROOMS, columns=ROOM_COLUMNS)
+            await conn.execute(MERGE_ROOMS_STAGING_SQL)
+            # Refresh planner statistics after the bulk load
+            await conn.execute("ANALYZE rooms")
         
         print("✅ Database schema created successfully!")
         